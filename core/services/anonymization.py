@@ -1,9 +1,18 @@
+import logging
+import multiprocessing
+import os
+import string
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 import spacy
 from spacy.pipeline import EntityRuler
-from pdfminer.high_level import extract_text
 import fitz
-from langdetect import detect
-from pdfminer.high_level import extract_text
+from langdetect import DetectorFactory, LangDetectException, detect
 
 
 MODEL_MAP = {
@@ -12,48 +21,399 @@ MODEL_MAP = {
     "es": "es_core_news_lg"
 }
 
-def detect_language(text):
-    print(text)
+# Components the entity recognizer does not depend on, never loaded.
+NER_EXCLUDED_PIPES = ("tagger", "morphologizer", "parser", "senter", "attribute_ruler", "lemmatizer")
+
+
+class PipelineCache:
+    """
+    Keeps loaded spaCy pipelines for the lifetime of the process.
+
+    Pipelines are keyed by model name and excluded components, loaded on first use and
+    shared by every document. At most `max_pipelines` stay resident: loading another one
+    evicts the least recently used.
+    """
+
+    def __init__(self, max_pipelines=2):
+        self.max_pipelines = max_pipelines
+        self._pipelines = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, model, exclude=NER_EXCLUDED_PIPES):
+        key = (model, tuple(sorted(exclude)))
+        with self._lock:
+            nlp = self._pipelines.get(key)
+            if nlp is not None:
+                self._pipelines.move_to_end(key)
+                self.hits += 1
+                return nlp
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given pipeline, the others wait for it.
+        with load_lock:
+            with self._lock:
+                nlp = self._pipelines.get(key)
+            if nlp is None:
+                start = time.perf_counter()
+                nlp = spacy.load(model, exclude=list(exclude))
+                logging.info(f"spaCy pipeline {model} loaded in {time.perf_counter() - start:.1f}s ({', '.join(nlp.pipe_names)})")
+                with self._lock:
+                    self.loads += 1
+                    self._pipelines[key] = nlp
+                    while len(self._pipelines) > self.max_pipelines:
+                        evicted, _ = self._pipelines.popitem(last=False)
+                        self.evictions += 1
+                        logging.info(f"spaCy pipeline {evicted[0]} evicted")
+            return nlp
+
+    def preload(self, models=None):
+        """
+        Loads pipelines ahead of the first document.
+
+        By default the model of DEFAULT_LANGUAGE, then the other MODEL_MAP models, as many as
+        stay resident. A list longer than `max_pipelines` is refused: its last models would
+        evict the first ones before any document used them.
+        """
+        if models is None:
+            default = MODEL_MAP[DEFAULT_LANGUAGE]
+            models = [default] + [model for model in MODEL_MAP.values() if model != default]
+            models = models[:self.max_pipelines]
+        models = list(models)
+        if len(models) > self.max_pipelines:
+            raise ValueError(f"Cannot preload {len(models)} pipelines, at most {self.max_pipelines} stay resident")
+        # The first model is loaded last, the most recently used is the last to be evicted.
+        for model in reversed(models):
+            self.get(model)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_pipelines": self.max_pipelines,
+                "resident": [model for model, _ in self._pipelines],
+                "hits": self.hits,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+pipelines = PipelineCache()
+
+DEFAULT_LANGUAGE = "fr"
+# Detection only looks at a bounded sample of each text, so its cost does not grow with the document.
+LANGUAGE_SAMPLE_CHARS = 1000
+LANGUAGE_SAMPLE_SLICES = 4
+# Below this length a page is too short to detect reliably and keeps the language of the previous one.
+LANGUAGE_MIN_CHARS = 40
+# The main language of a document, given to its pages too short or undetectable before any other page is
+# detected, comes from this many evenly spaced pages.
+LANGUAGE_SAMPLE_PAGES = 5
+
+# langdetect is randomized, a fixed seed makes the same text always get the same language.
+DetectorFactory.seed = 0
+
+
+def language_sample(text: str) -> str:
+    if len(text) <= LANGUAGE_SAMPLE_CHARS:
+        return text
+    # Evenly spaced slices rather than the beginning only, which is often a header.
+    size = LANGUAGE_SAMPLE_CHARS // LANGUAGE_SAMPLE_SLICES
+    step = (len(text) - size) // (LANGUAGE_SAMPLE_SLICES - 1)
+    return "\n".join(text[i * step:i * step + size] for i in range(LANGUAGE_SAMPLE_SLICES))
+
+
+def detect_language(text: str, default: str = None) -> str:
+    default = default or MODEL_MAP[DEFAULT_LANGUAGE]
     try:
-        return MODEL_MAP[detect(text)]
-    except Exception:
-        return "unknown"
+        language = detect(language_sample(text))
+    except LangDetectException:
+        return default
+    if language not in MODEL_MAP:
+        logging.warning(f"No model for language {language}, using {default}")
+        return default
+    return MODEL_MAP[language]
 
 
-def words_to_anonymize(model: str, text: str) -> list[str]:
-    nlp = spacy.load(model)
+def sample_pages(page_spans) -> list[tuple[int, int]]:
+    pages = [(start, end) for _, start, end in page_spans if end - start >= LANGUAGE_MIN_CHARS]
+    if len(pages) <= LANGUAGE_SAMPLE_PAGES:
+        return pages
+    step = (len(pages) - 1) / (LANGUAGE_SAMPLE_PAGES - 1)
+    return [pages[round(i * step)] for i in range(LANGUAGE_SAMPLE_PAGES)]
+
+
+def language_segments(document_text, per_page: bool = True) -> list[tuple[str, int, int]]:
+    # Consecutive pages of the same language are grouped into (model, start, end) text ranges.
+    text = document_text.text
+    if not text:
+        return []
+    if not per_page:
+        return [(detect_language(text), 0, len(text))]
+
+    # Every page with enough text is detected, each on a bounded sample: the cost stays constant per page.
+    detected = {start: detect_language(text[start:end]) for start, end in sample_pages(document_text.page_spans)}
+    main_language = Counter(detected.values()).most_common(1)[0][0] if detected else detect_language(text)
+
+    segments = []
+    for _, start, end in document_text.page_spans:
+        previous = segments[-1][0] if segments else main_language
+        if start in detected:
+            model = detected[start]
+        elif end - start < LANGUAGE_MIN_CHARS:
+            model = previous
+        else:
+            model = detect_language(text[start:end], default=previous)
+        if segments and model == segments[-1][0]:
+            segments[-1][2] = end
+        else:
+            segments.append([model, start, end])
+    return [tuple(segment) for segment in segments]
+
+
+SENSITIVE_LABELS = {"PERSON", "EMAIL", "PHONE_NUMBER", "ADDRESS", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "WORK_OF_ART"}
+
+
+def entity_spans(model: str, text: str) -> list[tuple[int, int]]:
+    nlp = pipelines.get(model)
     doc = nlp(text)
-    words = []
+    return [(ent.start_char, ent.end_char) for ent in doc.ents if ent.label_ in SENSITIVE_LABELS]
+
+
+def routed_entity_spans(document_text, per_page: bool = True) -> list[tuple[int, int]]:
+    # Each language segment goes to its own cached model, spans are shifted back to document offsets.
+    spans = []
+    for model, start, end in language_segments(document_text, per_page):
+        logging.info(f"Characters {start}-{end} routed to {model}")
+        spans.extend((start + s, start + e) for s, e in entity_spans(model, document_text.text[start:end]))
+    return spans
 
-    for ent in doc.ents:
-        if ent.label_ in ["PERSON", "EMAIL", "PHONE_NUMBER", "ADDRESS", "ORG", "GPE", "LOC", "PRODUCT", "EVENT", "WORK_OF_ART"]:
-            words.append(ent.text)
+
+def words_to_anonymize(model: str, text: str) -> list[str]:
+    words = [text[start:end] for start, end in entity_spans(model, text)]
 
     print("Words to anonymize:", words)
 
     return words
 
 
-def anonymize_text(words: list[str], document: str):
-    doc = fitz.open(document)
+class DocumentText:
+    """
+    The text of a PDF read once with PyMuPDF, with the box of every word.
+
+    Words are joined with a space within a line, a newline between lines and a blank
+    line between blocks and pages. `starts`/`ends` give the character offsets of each
+    word in `text`, so an entity span found by NER maps directly to the word boxes.
+    `page_spans` lists the (page number, start, end) text range of every non-empty page.
+    """
+
+    def __init__(self, doc, first_page=0, last_page=None):
+        parts = []
+        self.starts, self.ends, self.pages, self.rects = [], [], [], []
+        self.page_spans = []
+        offset = 0
+        previous = None
+
+        for page in doc.pages(first_page, last_page):
+            page_start = None
+            for x0, y0, x1, y1, word, block, line, _ in page.get_text("words"):
+                if previous is not None:
+                    if previous == (page.number, block, line):
+                        separator = " "
+                    elif previous[:2] == (page.number, block):
+                        separator = "\n"
+                    else:
+                        separator = "\n\n"
+                    parts.append(separator)
+                    offset += len(separator)
+                parts.append(word)
+                if page_start is None:
+                    page_start = offset
+                self.starts.append(offset)
+                self.ends.append(offset + len(word))
+                self.pages.append(page.number)
+                self.rects.append(fitz.Rect(x0, y0, x1, y1))
+                offset += len(word)
+                previous = (page.number, block, line)
+            if page_start is not None:
+                self.page_spans.append((page.number, page_start, offset))
+
+        self.text = "".join(parts)
+
+    def boxes(self, start: int, end: int) -> list[tuple[int, object]]:
+        # Words overlapping [start, end): those ending after start and starting before end.
+        first = bisect_right(self.ends, start)
+        last = bisect_left(self.starts, end)
+        return [(self.pages[i], self.rects[i]) for i in range(first, last)]
+
 
+def redact_spans(doc, document_text: DocumentText, spans: list[tuple[int, int]], output_path: str) -> int:
+    rects_by_page = {}
+    for start, end in spans:
+        for page_number, rect in document_text.boxes(start, end):
+            rects_by_page.setdefault(page_number, []).append(rect)
+
+    for page_number, rects in rects_by_page.items():
+        page = doc[page_number]
+        for rect in rects:
+            page.add_redact_annot(rect, fill=(0, 0, 0))
+        page.apply_redactions()
+
+    doc.save(output_path)
+    return sum(len(rects) for rects in rects_by_page.values())
+
+
+def normalize_token(token: str) -> str:
+    return token.strip(string.punctuation + "«»“”’").casefold()
+
+
+def redaction_rects(page, targets: dict[str, set[tuple[str, ...]]]) -> list:
+    # One pass over the words of the page, each compared with the terms starting with it.
+    page_words = page.get_text("words")
+    tokens = [normalize_token(word[4]) for word in page_words]
+    rects = []
+
+    for i, token in enumerate(tokens):
+        for target in targets.get(token, ()):
+            if tuple(tokens[i:i + len(target)]) == target:
+                rects.extend(fitz.Rect(word[:4]) for word in page_words[i:i + len(target)])
+
+    return rects
+
+
+def redaction_targets(words) -> dict[str, set[tuple[str, ...]]]:
+    # Terms to redact as token sequences, indexed by their first token.
+    targets = {}
     for w in words:
-        for page in doc:
-            text_instances = page.search_for(w) 
+        tokens = tuple(token for token in map(normalize_token, w.split()) if token)
+        if tokens:
+            targets.setdefault(tokens[0], set()).add(tokens)
+    return targets
 
-            for inst in text_instances:
-                page.add_redact_annot(inst, fill=(0, 0, 0))
+
+def anonymize_text(words: list[str], document: str, output_path: str = "document_anonymized.pdf") -> int:
+    targets = redaction_targets(words)
+
+    doc = fitz.open(document)
+    redacted = 0
+
+    for page in doc:
+        rects = redaction_rects(page, targets)
+        for rect in rects:
+            page.add_redact_annot(rect, fill=(0, 0, 0))
+        if rects:
             page.apply_redactions()
+        redacted += len(rects)
+
+    doc.save(output_path)
+    doc.close()
+    return redacted
+
+
+def process_anonymization(document: str, output_path: str = "document_anonymized.pdf", per_page_language: bool = True):
+    # The PDF is parsed once: the same words feed NER and locate the redactions.
+    doc = fitz.open(document)
+    document_text = DocumentText(doc)
+    spans = routed_entity_spans(document_text, per_page_language)
+    print("Words to anonymize:", [document_text.text[start:end] for start, end in spans])
+    redacted = redact_spans(doc, document_text, spans, output_path)
+    doc.close()
+    print(f"{redacted} words redacted, saved to {output_path}")
+
+
+# Process pool of the parallel mode, kept across documents so that each worker keeps its spaCy pipelines warm.
+_pool = None
+_pool_workers = None
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        # Spawned rather than forked, the parent may already run threads.
+        _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        _pool_workers = workers
+    return _pool
+
+
+def find_shard_entities(document: str, first_page: int, last_page: int, per_page_language: bool = True):
+    # Runs in a worker: extraction, language routing and NER of a page range, entity boxes resolved locally.
+    doc = fitz.open(document)
+    document_text = DocumentText(doc, first_page, last_page)
+    spans = routed_entity_spans(document_text, per_page_language)
+    doc.close()
+
+    rects = [(page_number, tuple(rect)) for start, end in spans for page_number, rect in document_text.boxes(start, end)]
+    words = {document_text.text[start:end] for start, end in spans}
+    return rects, words
+
+
+def redact_shard(document: str, first_page: int, last_page: int, rects, words, shard_path: str) -> int:
+    # Redacts the entities of the shard plus those found on any other page, in a worker unless there is one shard.
+    targets = redaction_targets(words)
+    rects_by_page = {}
+    for page_number, rect in rects:
+        rects_by_page.setdefault(page_number, []).append(rect)
+
+    doc = fitz.open(document)
+    redacted = 0
+    for page in doc.pages(first_page, last_page):
+        # The boxes of the shard's own entities are usually found again by the cross-page terms.
+        page_rects = set(map(tuple, rects_by_page.get(page.number, []) + redaction_rects(page, targets)))
+        for rect in page_rects:
+            page.add_redact_annot(rect, fill=(0, 0, 0))
+        if page_rects:
+            page.apply_redactions()
+        redacted += len(page_rects)
+
+    doc.select(list(range(first_page, last_page)))
+    # Without garbage collection the shard would keep the objects of every page of the source.
+    doc.save(shard_path, garbage=4, deflate=True)
+    doc.close()
+    return redacted
+
+
+def process_anonymization_parallel(document: str, output_path: str = "document_anonymized.pdf",
+                                   workers: int = None, pages_per_shard: int = 10, per_page_language: bool = True):
+    workers = workers or os.cpu_count() or 1
+    with fitz.open(document) as doc:
+        page_count = doc.page_count
+
+    if page_count <= pages_per_shard:
+        # Same two phases in this process, so the redactions do not depend on the page count or shard size.
+        rects, words = find_shard_entities(document, 0, page_count, per_page_language)
+        print("Words to anonymize:", sorted(words))
+        redacted = redact_shard(document, 0, page_count, rects, words, output_path)
+        print(f"{redacted} words redacted on {page_count} pages, saved to {output_path}")
+        return
+
+    shards = [(first, min(first + pages_per_shard, page_count)) for first in range(0, page_count, pages_per_shard)]
+    pool = get_pool(workers)
+
+    found = list(pool.map(find_shard_entities, *zip(*[(document, first, last, per_page_language) for first, last in shards])))
+    # Cross-page entity set: an entity tagged on one page is redacted wherever it appears.
+    words = set().union(*(shard_words for _, shard_words in found))
+    print("Words to anonymize:", sorted(words))
 
-    doc.save("document_anonymized.pdf")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shard_paths = [os.path.join(tmp_dir, f"shard_{i}.pdf") for i in range(len(shards))]
+        redacted = sum(pool.map(
+            redact_shard,
+            *zip(*[(document, first, last, rects, words, path) for (first, last), (rects, _), path in zip(shards, found, shard_paths)])
+        ))
 
+        output = fitz.open()
+        for path in shard_paths:
+            with fitz.open(path) as shard:
+                output.insert_pdf(shard)
+        # Each shard carries its own copy of the shared fonts and images, merged back into one here.
+        output.save(output_path, garbage=4, deflate=True)
+        output.close()
 
-def process_anonymization(document: str):
-    text = extract_text(document)
-    model = detect_language(text)
-    print(f"Document language: {model}")
-    words = words_to_anonymize(model, text)
-    anonymize_text(words, document)
+    print(f"{redacted} words redacted on {page_count} pages, saved to {output_path}")
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from langdetect import detect
+from langdetect import DetectorFactory, LangDetectException, detect
 
 
 MODEL_MAP = {
@@ -7,17 +7,37 @@ MODEL_MAP = {
     "es": "es_core_news_lg"
 }
 
-def detect_language(text):
+DEFAULT_LANGUAGE = "fr"
+# Only a bounded sample is given to langdetect, whatever the length of the text.
+LANGUAGE_SAMPLE_CHARS = 1000
+LANGUAGE_SAMPLE_SLICES = 4
+
+# langdetect is randomized, a fixed seed makes the same text always get the same language.
+DetectorFactory.seed = 0
+
+
+def language_sample(text):
+    if len(text) <= LANGUAGE_SAMPLE_CHARS:
+        return text
+    size = LANGUAGE_SAMPLE_CHARS // LANGUAGE_SAMPLE_SLICES
+    step = (len(text) - size) // (LANGUAGE_SAMPLE_SLICES - 1)
+    return "\n".join(text[i * step:i * step + size] for i in range(LANGUAGE_SAMPLE_SLICES))
+
+
+def detect_language(text, default=None):
+    default = default or MODEL_MAP[DEFAULT_LANGUAGE]
     try:
-        return MODEL_MAP[detect(text)]
-    except Exception:
-        return "unknown"
+        return MODEL_MAP.get(detect(language_sample(text)), default)
+    except LangDetectException:
+        return default
 
 texts = [
-    "Salut les amis, comment vous allez? ", 
+    "Salut les amis, comment vous allez? ",
     "Hi friends, how are you?",
+    "Hola amigos, ¿cómo estáis?",
+    "",
 ]
 
 for text in texts:
-    model = detect_language(text)  
+    model = detect_language(text)
     print(f"Texte: {text} - model: {model}")
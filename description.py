@@ -1,121 +1,414 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-import langid
-import re
-from pdfminer.high_level import extract_text
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 import os
-import tempfile
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from document_tasks import (
+    CHUNK_GENERATION_KWARGS,
+    DECODING_PROFILES,
+    DEFAULT_MODEL,
+    DEFAULT_PROFILE,
+    MAX_INPUT_TOKENS,
+    clean_text,
+    get_runtime,
+    prepare_prompt,
+    run_task,
+)
+from metrics import LatencyStats
+from result_cache import ResultCache
+from worker_pool import JobStore, PoolSaturated, WorkerPool
+
+PRELOAD_MODELS = [name for name in os.environ.get("PRELOAD_MODELS", DEFAULT_MODEL).split(",") if name]
+STREAM_TOKEN_TIMEOUT_S = float(os.environ.get("STREAM_TOKEN_TIMEOUT_S", 120))
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 256))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_MB = float(os.environ.get("RESULT_CACHE_DISK_MB", 512))
+WORKER_POOL_KIND = os.environ.get("WORKER_POOL_KIND", "thread")
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", 4))
+WORKER_QUEUE_SIZE = int(os.environ.get("WORKER_QUEUE_SIZE", 16))
+RETRY_AFTER_S = int(os.environ.get("RETRY_AFTER_S", 5))
+MAX_JOBS = int(os.environ.get("MAX_JOBS", 1000))
+JOB_TTL_S = float(os.environ.get("JOB_TTL_S", 3600))
+MAX_UPLOAD_MB = float(os.environ.get("MAX_UPLOAD_MB", 50))
+# Room for the multipart boundary and part headers around the uploaded file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+TASK_RESULT_KEYS = {"summarize": "Summary", "describe": "Description"}
 
 app = FastAPI()
+runtime = get_runtime()
+registry, scheduler, chunk_cache = runtime.registry, runtime.scheduler, runtime.chunk_cache
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_SIZE,
+    disk_dir=RESULT_CACHE_DIR,
+    disk_max_bytes=int(RESULT_CACHE_DISK_MB * 1024 * 1024),
+)
+pool = WorkerPool(kind=WORKER_POOL_KIND, max_workers=WORKER_POOL_SIZE, max_queue=WORKER_QUEUE_SIZE)
+jobs = JobStore(max_jobs=MAX_JOBS, ttl_s=JOB_TTL_S)
+time_to_first_token = LatencyStats()
+stream_latency = LatencyStats()
 
-def detect_language(text):
-    lang, _ = langid.classify(text)
-    return lang if lang in ["fr", "en"] else "en"
 
-def clean_text(text):
-    text = re.sub(r"<extra_id_\d+>", "", text)
-    text = re.sub(r"\b(\w+)(?:\s+\1\b)+", r"\1", text)
-    text = re.sub(r"\s+", " ", text).strip()
-    if text.lower().startswith("ce document parle de") or text.lower().startswith("this document discusses"):
-        return text
-    else:
-        prefix = "Ce document parle de " if detect_language(text) == "fr" else "This document discusses "
-        return prefix + text
+@app.on_event("startup")
+def load_models():
+    for model_name in PRELOAD_MODELS:
+        registry.get(model_name)
+
+def streaming_kwargs(profile):
+    """Streamers do not support beam search, beam profiles are streamed by sampling with a single beam."""
+    kwargs = dict(DECODING_PROFILES[profile])
+    if kwargs.get("num_beams", 1) > 1:
+        kwargs.pop("early_stopping", None)
+        kwargs.update(num_beams=1, do_sample=True)
+    return kwargs
 
-def process_document(file_path, task):
+def check_profile(profile):
+    if profile not in DECODING_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile: {profile}. Available: {sorted(DECODING_PROFILES)}")
+
+def result_cache_key(digest, task, model_name, generation_kwargs, hierarchical):
+    options = {"hierarchical": hierarchical, "backend": registry.default_backend}
+    if hierarchical:
+        options["chunk_generation"] = CHUNK_GENERATION_KWARGS
+    return ResultCache.make_key(digest, task, model_name, generation_kwargs, **options)
+
+def process_document(file_path, task, model_name=DEFAULT_MODEL, hierarchical=True, use_cache=True, profile=DEFAULT_PROFILE):
     """
     Processes a document by extracting its text, detecting its language, and performing a specified task 
     (either summarizing or describing the document) using a pre-trained language model.
 
+    Goes through the same result cache and worker pool as the upload endpoints, and blocks until done.
+
     Args:
         file_path (str): The path to the document file to be processed.
         task (str): The task to perform on the document. Can be either "summarize" or "describe".
+        model_name (str): The name of the model to use, loaded through the model registry.
+        hierarchical (bool): Condense documents longer than the model input instead of truncating them.
+        use_cache (bool): Look the result up in the result cache before processing the document.
+        profile (str): The name of the decoding profile, see DECODING_PROFILES.
 
     Returns:
         str: The processed text (summary or description) of the document.
 
     Raises:
         ValueError: If the task is not "summarize" or "describe".
+        HTTPException: 503 if the worker pool is saturated.
     """
-    model_name = "google/flan-t5-large"
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-
-    texte = extract_text(file_path)
-    langue = detect_language(texte)
-
-    if task == "summarize":
-        if langue == "en":
-            prompt = (
-                "You are an expert in document analysis. Please provide a concise and clear summary of the following text, "
-                "highlighting the key points and essential information. "
-                "Ensure that the summary is well-structured and accurately reflects the content of the original text. "
-                "Here is the text to summarize:\n\n" + texte
-            )
-        else:
-            prompt = (
-                "Vous êtes un expert en analyse de documents. Veuillez reformuler le texte suivant en utilisant vos propres mots, "
-                "tout en conservant le sens original. Assurez-vous que la reformulation soit claire, concise et bien structurée. "
-                "N'hésitez pas à utiliser des alinéas et des retours à la ligne pour bien séparer les paragraphes. Faites bien attention à la cohérence du texte. "
-                "Voici le texte à reformuler :\n\n" + texte
-            )
-    elif task == "describe":
-        if langue == "en":
-            prompt = (
-                "Analyze and describe the main content and key points of the following text. "
-                "Start your response with exactly 'This document discusses' and then continue with "
-                "a natural description of what the document contains and explains. "
-                "Focus on the main topics and important information. Here's the text:\n\n" + texte
-            )
-        else:
-            prompt = (
-                "Vous êtes un expert en analyse de documents. À partir du texte extrait, veuillez fournir une description détaillée et structurée du document lui-même, "
-                "sans résumer simplement son contenu. Commencez impérativement votre description par la phrase exacte : 'Ce document parle de ...'. "
-                "Ensuite, décrivez le contexte (objectif, public visé, format de publication), la structure, le ton et le style du document, "
-                "ainsi que toutes les caractéristiques remarquables qui le définissent. Votre description doit être claire, concise, bien organisée et professionnelle. "
-                "Voici le texte extrait :\n\n" + texte
-            )
-
-    inputs = tokenizer(prompt, return_tensors="pt", max_length=1024, truncation=True)
-    output = model.generate(
-        **inputs,
-        max_length=700,
-        min_length=300,
-        num_beams=5,
-        do_sample=True,
-        temperature=0.7,
-        no_repeat_ngram_size=3,
-        early_stopping=True,
+    with open(file_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    return submit_cached_task(data, digest, task, hierarchical, use_cache, profile, model_name).result()
+
+def service_busy():
+    return HTTPException(
+        status_code=503,
+        detail="The service is busy, please retry later.",
+        headers={"Retry-After": str(RETRY_AFTER_S)},
     )
 
-    description = tokenizer.decode(output[0], skip_special_tokens=True)
-    return clean_text(description)
+def submit_task(fn, *args, **kwargs):
+    """Submits work to the worker pool, rejecting the request with a 503 when the pool is saturated."""
+    try:
+        return pool.submit(fn, *args, **kwargs)
+    except PoolSaturated:
+        raise service_busy()
 
-@app.post("/summarize/")
-async def summarize_file(file: UploadFile = File(...)):
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="Invalid file type. Only PDFs are accepted.")
+def reserve_slot():
+    """Takes a worker pool slot for later work, rejecting the request with a 503 when the pool is saturated."""
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-        summary = process_document(tmp_path, task="summarize")
-        os.remove(tmp_path)
-        return JSONResponse(content={"Summary": summary})
+        return pool.reserve()
+    except PoolSaturated:
+        raise service_busy()
+
+class StopOnEvent(StoppingCriteria):
+    """Stops a generation once the event is set, checked after every generated token."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+def stream_generation(prompt, streamer, generation_kwargs, model_name=DEFAULT_MODEL, stop=None):
+    loaded = registry.get(model_name)
+    inputs = loaded.tokenizer(prompt, return_tensors="pt", max_length=MAX_INPUT_TOKENS, truncation=True)
+    try:
+        if stop is not None:
+            generation_kwargs = dict(generation_kwargs, stopping_criteria=StoppingCriteriaList([StopOnEvent(stop)]))
+        loaded.model.generate(**inputs, **generation_kwargs, streamer=streamer)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logging.error(f"Streaming generation failed: {str(e)}")
+        streamer.end()
+        raise
 
-@app.post("/describe/")
-async def describe_file(file: UploadFile = File(...)):
+def start_streaming(prompt, profile=DEFAULT_PROFILE, model_name=DEFAULT_MODEL, stop=None, reservation=None):
+    """
+    Starts generating on a worker thread and returns a streamer yielding the decoded text.
+
+    Args:
+        prompt (str): The full prompt given to the model.
+        profile (str): The name of the decoding profile, see DECODING_PROFILES.
+        model_name (str): The name of the model to use, loaded through the model registry.
+        stop (threading.Event): Ends the generation early once set.
+        reservation (Reservation): A worker pool slot taken beforehand for the generation.
+
+    Returns:
+        tuple: The TextIteratorStreamer and the future of the generation.
+
+    Raises:
+        PoolSaturated: If no slot was reserved and the worker pool has no free slot.
+    """
+    tokenizer = registry.get(model_name).tokenizer
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=STREAM_TOKEN_TIMEOUT_S)
+    # The streamer cannot leave this process, the generation runs on a local thread.
+    generation = pool.submit(stream_generation, prompt, streamer, streaming_kwargs(profile), model_name, stop,
+                             local=True, reservation=reservation)
+    return streamer, generation
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_document(request, prompt_future, generation_slot, profile, result_key, cache_key):
+    """
+    Yields server-sent events for a task: "token" events with the text as it is generated, then a
+    "done" event with the `clean_text` post-processed result, or an "error" event.
+
+    The generation runs in `generation_slot`, reserved before the response started, and is stopped
+    as soon as the client disconnects.
+    """
+    started = time.perf_counter()
+    stop = threading.Event()
+    # Sent right away so that proxies see bytes while the text is being extracted.
+    yield ": processing\n\n"
+    try:
+        prompt = await asyncio.wrap_future(prompt_future)
+        if await request.is_disconnected():
+            return
+        streamer, generation = await asyncio.to_thread(
+            start_streaming, prompt, profile, stop=stop, reservation=generation_slot
+        )
+
+        parts = []
+        tokens = iter(streamer)
+        while (part := await asyncio.to_thread(next, tokens, None)) is not None:
+            if await request.is_disconnected():
+                logging.info(f"Client disconnected after {len(parts)} streamed parts, generation stopped")
+                return
+            if not parts:
+                time_to_first_token.record(time.perf_counter() - started)
+            parts.append(part)
+            yield sse_event("token", {"text": part})
+        await asyncio.wrap_future(generation)
+
+        stream_latency.record(time.perf_counter() - started)
+        result = clean_text("".join(parts))
+        result_cache.put(cache_key, result)
+        yield sse_event("done", {result_key: result})
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        # Also reached when the response is cancelled, the generation thread must not keep running.
+        stop.set()
+        generation_slot.release()
+
+def upload_too_large():
+    return HTTPException(status_code=413, detail=f"The file is larger than {MAX_UPLOAD_MB:g} MB.")
+
+class UploadSizeLimit:
+    """
+    ASGI middleware enforcing the upload size limit while the request body is received, before
+    it is parsed and spooled. A declared Content-Length over the limit is rejected with 413
+    without reading the body, and a body that goes over the limit is cut off with 413.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            error = upload_too_large()
+            await JSONResponse(status_code=error.status_code, content={"detail": error.detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Re-raised as is by FastAPI while it reads the body, and answered with a 413.
+                    raise upload_too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimit, max_bytes=int(MAX_UPLOAD_MB * 1024 * 1024) + MULTIPART_OVERHEAD_BYTES)
+
+async def read_pdf_upload(file):
+    """
+    Reads an uploaded PDF and hashes it.
+
+    The body was already received under the UploadSizeLimit middleware and spooled by Starlette
+    (to disk past 1 MB); it is read back into a single bytes object, the one handed to the worker.
+
+    Returns:
+        tuple: The bytes of the upload and their SHA-256 hex digest.
+    """
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Invalid file type. Only PDFs are accepted.")
+    max_bytes = int(MAX_UPLOAD_MB * 1024 * 1024)
+    if file.size is not None and file.size > max_bytes:
+        raise upload_too_large()
+
+    data = await file.read()
+    if len(data) > max_bytes:
+        raise upload_too_large()
+    return data, hashlib.sha256(data).hexdigest()
+
+def submit_cached_task(data, digest, task, hierarchical, use_cache, profile, model_name=DEFAULT_MODEL):
+    """
+    Returns a future resolving to the result of a task, taken from the result cache when possible.
+    With `use_cache` false, a cached result is ignored and replaced.
+    """
+    key = result_cache_key(digest, task, model_name, DECODING_PROFILES[profile], hierarchical)
+    if use_cache and (cached := result_cache.get(key)) is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+
+    def store(done):
+        if not done.cancelled() and done.exception() is None:
+            result_cache.put(key, done.result())
+
+    future = submit_task(run_task, data, task, hierarchical, profile, model_name)
+    future.add_done_callback(store)
+    return future
+
+async def process_upload(file, task, hierarchical, use_cache, profile):
+    check_profile(profile)
+    data, digest = await read_pdf_upload(file)
+    future = submit_cached_task(data, digest, task, hierarchical, use_cache, profile)
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-        description = process_document(tmp_path, task="describe")
-        os.remove(tmp_path)
-        return JSONResponse(content={"Description": description})
+        result = await asyncio.wrap_future(future)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return JSONResponse(content={TASK_RESULT_KEYS[task]: result})
+
+async def stream_cached(result_key, result):
+    yield sse_event("done", {result_key: result})
+
+async def stream_file(request, file, task, hierarchical, use_cache, profile):
+    check_profile(profile)
+    data, digest = await read_pdf_upload(file)
+    result_key = TASK_RESULT_KEYS[task]
+    key = result_cache_key(digest, task, DEFAULT_MODEL, streaming_kwargs(profile), hierarchical)
+    if use_cache and (cached := result_cache.get(key)) is not None:
+        events = stream_cached(result_key, cached)
+    else:
+        # Both slots are taken before the response starts, so that saturation is a 503 and not an error event.
+        generation_slot = reserve_slot()
+        try:
+            prompt_future = submit_task(prepare_prompt, data, task, hierarchical)
+        except HTTPException:
+            generation_slot.release()
+            raise
+        events = stream_document(request, prompt_future, generation_slot, profile, result_key, key)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/summarize/")
+async def summarize_file(
+    file: UploadFile = File(...), hierarchical: bool = True, use_cache: bool = True, profile: str = DEFAULT_PROFILE
+):
+    return await process_upload(file, "summarize", hierarchical, use_cache, profile)
+
+@app.post("/describe/")
+async def describe_file(
+    file: UploadFile = File(...), hierarchical: bool = True, use_cache: bool = True, profile: str = DEFAULT_PROFILE
+):
+    return await process_upload(file, "describe", hierarchical, use_cache, profile)
+
+@app.post("/summarize/stream/")
+async def summarize_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    hierarchical: bool = True,
+    use_cache: bool = True,
+    profile: str = DEFAULT_PROFILE,
+):
+    return await stream_file(request, file, "summarize", hierarchical, use_cache, profile)
+
+@app.post("/describe/stream/")
+async def describe_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    hierarchical: bool = True,
+    use_cache: bool = True,
+    profile: str = DEFAULT_PROFILE,
+):
+    return await stream_file(request, file, "describe", hierarchical, use_cache, profile)
+
+@app.post("/jobs/")
+async def submit_job(
+    file: UploadFile = File(...),
+    task: str = "summarize",
+    hierarchical: bool = True,
+    use_cache: bool = True,
+    profile: str = DEFAULT_PROFILE,
+):
+    """Queues a task on a document too large to be processed inline; poll GET /jobs/{job_id} for the result."""
+    if task not in TASK_RESULT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unknown task: {task}")
+    check_profile(profile)
+    data, digest = await read_pdf_upload(file)
+    future = submit_cached_task(data, digest, task, hierarchical, use_cache, profile)
+    job_id = jobs.add(future, task=task)
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued"},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    status = jobs.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    if "result" in status:
+        status[TASK_RESULT_KEYS[status["task"]]] = status.pop("result")
+    return JSONResponse(content=status)
+
+@app.get("/models/")
+async def list_models():
+    return JSONResponse(content=registry.stats())
+
+@app.get("/stats/")
+async def service_stats():
+    return JSONResponse(content={
+        "worker_pool": pool.stats(),
+        "scheduler": scheduler.stats(),
+        "chunk_cache": chunk_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "streaming": {
+            "time_to_first_token": time_to_first_token.summary(),
+            "total_latency": stream_latency.summary(),
+        },
+    })
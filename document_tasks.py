@@ -0,0 +1,217 @@
+"""
+Document tasks run by the worker pool of the description service.
+
+Pool workers of kind "process" are spawned interpreters that unpickle their task functions from
+this module. It must stay free of import-time side effects: the models, batching scheduler and
+chunk cache of a process are only built by `get_runtime`, on first use.
+"""
+import io
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+import langid
+from pdfminer.high_level import extract_text
+
+from inference_scheduler import InferenceScheduler
+from map_reduce import ChunkCache, MapReduceSummarizer
+from model_registry import ModelRegistry
+
+DEFAULT_MODEL = os.environ.get("SUMMARY_MODEL", "google/flan-t5-large")
+MODEL_MEMORY_BUDGET_MB = float(os.environ.get("MODEL_MEMORY_BUDGET_MB", 0)) or None
+# One of inference_backends.BACKENDS: pytorch-fp32, pytorch-int8 or onnx.
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "pytorch-fp32")
+DEFAULT_PROFILE = os.environ.get("DEFAULT_PROFILE", "quality")
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 50))
+MAX_INPUT_TOKENS = 1024
+# Leaves room for the instruction prompt around each chunk.
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 768))
+CHUNK_MAX_IN_FLIGHT = int(os.environ.get("CHUNK_MAX_IN_FLIGHT", 2 * BATCH_MAX_SIZE))
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", 1024))
+LANGUAGE_SAMPLE_CHARS = 5000
+
+# Decoding profiles, chosen per request with ?profile=
+DECODING_PROFILES = {
+    "quality": {
+        "max_length": 700,
+        "min_length": 300,
+        "num_beams": 5,
+        "do_sample": True,
+        "temperature": 0.7,
+        "no_repeat_ngram_size": 3,
+        "early_stopping": True,
+    },
+    "fast": {
+        "max_length": 256,
+        "min_length": 30,
+        "num_beams": 1,
+        "do_sample": False,
+        "no_repeat_ngram_size": 3,
+    },
+}
+
+# Chunk summaries are deterministic so that they can be reused across documents.
+CHUNK_GENERATION_KWARGS = {
+    "max_length": 200,
+    "min_length": 30,
+    "num_beams": 4,
+    "no_repeat_ngram_size": 3,
+    "early_stopping": True,
+}
+
+@dataclass
+class TaskRuntime:
+    """The resident models, batching scheduler and chunk cache shared by the tasks of a process."""
+    registry: ModelRegistry
+    scheduler: InferenceScheduler
+    chunk_cache: ChunkCache
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime():
+    """Returns the TaskRuntime of this process, built on first use in the API process and in each pool worker."""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            registry = ModelRegistry(memory_budget_mb=MODEL_MEMORY_BUDGET_MB, default_backend=INFERENCE_BACKEND)
+            scheduler = InferenceScheduler(
+                registry,
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                max_input_tokens=MAX_INPUT_TOKENS,
+            )
+            _runtime = TaskRuntime(registry, scheduler, ChunkCache(max_entries=CHUNK_CACHE_SIZE))
+        return _runtime
+
+def detect_language(text):
+    lang, _ = langid.classify(text)
+    return lang if lang in ["fr", "en"] else "en"
+
+def clean_text(text):
+    text = re.sub(r"<extra_id_\d+>", "", text)
+    text = re.sub(r"\b(\w+)(?:\s+\1\b)+", r"\1", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    if text.lower().startswith("ce document parle de") or text.lower().startswith("this document discusses"):
+        return text
+    else:
+        prefix = "Ce document parle de " if detect_language(text) == "fr" else "This document discusses "
+        return prefix + text
+
+def build_prompt(texte, task):
+    """
+    Builds the instruction prompt for a task, in the language of the extracted text.
+
+    Args:
+        texte (str): The text extracted from the document.
+        task (str): Either "summarize" or "describe".
+
+    Returns:
+        str: The prompt to give to the model.
+
+    Raises:
+        ValueError: If the task is not "summarize" or "describe".
+    """
+    if task not in ("summarize", "describe"):
+        raise ValueError(f"Unknown task: {task}")
+
+    langue = detect_language(texte)
+
+    if task == "summarize":
+        if langue == "en":
+            prompt = (
+                "You are an expert in document analysis. Please provide a concise and clear summary of the following text, "
+                "highlighting the key points and essential information. "
+                "Ensure that the summary is well-structured and accurately reflects the content of the original text. "
+                "Here is the text to summarize:\n\n" + texte
+            )
+        else:
+            prompt = (
+                "Vous êtes un expert en analyse de documents. Veuillez reformuler le texte suivant en utilisant vos propres mots, "
+                "tout en conservant le sens original. Assurez-vous que la reformulation soit claire, concise et bien structurée. "
+                "N'hésitez pas à utiliser des alinéas et des retours à la ligne pour bien séparer les paragraphes. Faites bien attention à la cohérence du texte. "
+                "Voici le texte à reformuler :\n\n" + texte
+            )
+    elif task == "describe":
+        if langue == "en":
+            prompt = (
+                "Analyze and describe the main content and key points of the following text. "
+                "Start your response with exactly 'This document discusses' and then continue with "
+                "a natural description of what the document contains and explains. "
+                "Focus on the main topics and important information. Here's the text:\n\n" + texte
+            )
+        else:
+            prompt = (
+                "Vous êtes un expert en analyse de documents. À partir du texte extrait, veuillez fournir une description détaillée et structurée du document lui-même, "
+                "sans résumer simplement son contenu. Commencez impérativement votre description par la phrase exacte : 'Ce document parle de ...'. "
+                "Ensuite, décrivez le contexte (objectif, public visé, format de publication), la structure, le ton et le style du document, "
+                "ainsi que toutes les caractéristiques remarquables qui le définissent. Votre description doit être claire, concise, bien organisée et professionnelle. "
+                "Voici le texte extrait :\n\n" + texte
+            )
+
+    return prompt
+
+def build_chunk_prompt(passage, langue):
+    if langue == "en":
+        return (
+            "Summarize the following passage of a longer document. "
+            "Keep the key facts, names, dates and figures:\n\n" + passage
+        )
+    return (
+        "Résumez le passage suivant d'un document plus long. "
+        "Conservez les faits, noms, dates et chiffres essentiels :\n\n" + passage
+    )
+
+def condense_text(texte, model_name=DEFAULT_MODEL):
+    """
+    Reduces a text too long for the model input with map-reduce summarization passes.
+
+    The text is split into token-bounded chunks on paragraph boundaries, the chunks are summarized
+    in parallel through the batching scheduler, and the partial summaries are summarized again
+    until the result fits in a single input. Chunk summaries are cached and reused.
+
+    Args:
+        texte (str): The text extracted from the document.
+        model_name (str): The name of the model to use, loaded through the model registry.
+
+    Returns:
+        str: The text itself if it already fits, otherwise the condensed summary.
+    """
+    runtime = get_runtime()
+    langue = detect_language(texte[:LANGUAGE_SAMPLE_CHARS])
+    tokenizer = runtime.registry.get(model_name).tokenizer
+
+    def count_tokens(text):
+        return len(tokenizer(text, add_special_tokens=False).input_ids)
+
+    def summarize(passage):
+        return runtime.scheduler.submit(build_chunk_prompt(passage, langue), model_name, **CHUNK_GENERATION_KWARGS)
+
+    summarizer = MapReduceSummarizer(
+        summarize,
+        count_tokens,
+        max_tokens=CHUNK_MAX_TOKENS,
+        max_in_flight=CHUNK_MAX_IN_FLIGHT,
+        cache=runtime.chunk_cache,
+        cache_namespace=f"{model_name}|{runtime.registry.default_backend}|{langue}|{sorted(CHUNK_GENERATION_KWARGS.items())}",
+    )
+    return summarizer.condense(texte)
+
+def extract_upload_text(data):
+    """Extracts the text of an uploaded PDF straight from its bytes, without going through the disk."""
+    return extract_text(io.BytesIO(data))
+
+def prepare_prompt(data, task, hierarchical, model_name=DEFAULT_MODEL):
+    """Extracts the text of an uploaded PDF and builds the prompt of a task. Runs in a pool worker."""
+    texte = extract_upload_text(data)
+    if hierarchical:
+        texte = condense_text(texte, model_name)
+    return build_prompt(texte, task)
+
+def run_task(data, task, hierarchical, profile=DEFAULT_PROFILE, model_name=DEFAULT_MODEL):
+    """Performs a task on an uploaded PDF, from extraction to the cleaned output. Runs in a pool worker."""
+    prompt = prepare_prompt(data, task, hierarchical, model_name)
+    description = get_runtime().scheduler.submit(prompt, model_name, **DECODING_PROFILES[profile]).result()
+    return clean_text(description)
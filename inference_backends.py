@@ -0,0 +1,146 @@
+import argparse
+import logging
+import time
+from collections import Counter
+from pathlib import Path
+
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+BACKENDS = ("pytorch-fp32", "pytorch-int8", "onnx")
+
+
+def load_backend(name, backend="pytorch-fp32"):
+    """
+    Loads a tokenizer and a seq2seq model for the given inference backend.
+
+    Args:
+        name (str): The Hugging Face model name or local path.
+        backend (str): "pytorch-fp32" (reference), "pytorch-int8" (dynamic int8 quantization of
+            the linear layers, for CPU) or "onnx" (ONNX Runtime export, needs optimum[onnxruntime]).
+
+    Returns:
+        tuple: The tokenizer and the model, both exposing the usual `generate` API.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        RuntimeError: If the backend needs a package that is not installed.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    tokenizer = AutoTokenizer.from_pretrained(name)
+
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError:
+            raise RuntimeError("The onnx backend needs optimum[onnxruntime]: pip install optimum[onnxruntime]")
+        return tokenizer, ORTModelForSeq2SeqLM.from_pretrained(name, export=True)
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(name)
+    model.eval()
+    if backend == "pytorch-int8":
+        import torch
+
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+
+def model_size_bytes(model):
+    """Returns the memory held by the weights of a model, whatever its backend."""
+    if hasattr(model, "parameters"):
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+        size += sum(b.numel() * b.element_size() for b in model.buffers())
+        for module in model.modules():
+            # Dynamically quantized layers keep their packed weights outside of the parameters.
+            weight = getattr(module, "weight", None)
+            if callable(weight):
+                packed = weight()
+                size += packed.numel() * packed.element_size()
+        return size
+
+    # ONNX Runtime sessions: size of the exported graphs and their weights.
+    save_dir = getattr(model, "model_save_dir", None)
+    if save_dir is None:
+        return 0
+    return sum(path.stat().st_size for path in Path(save_dir).glob("*.onnx*"))
+
+
+def token_overlap(reference, candidate):
+    """Unigram F1 between two outputs (ROUGE-1), 1.0 when they use exactly the same words."""
+    reference_tokens = Counter(reference.lower().split())
+    candidate_tokens = Counter(candidate.lower().split())
+    common = sum((reference_tokens & candidate_tokens).values())
+    if not common:
+        return 0.0
+    precision = common / sum(candidate_tokens.values())
+    recall = common / sum(reference_tokens.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def compare_backends(name, prompts, backends=BACKENDS, generation_kwargs=None, max_input_tokens=1024):
+    """
+    Runs the same prompts through several backends and reports latency and output overlap.
+
+    The first backend is the reference the outputs of the others are compared with.
+
+    Returns:
+        list[dict]: One report per backend that could be loaded.
+    """
+    generation_kwargs = generation_kwargs or {}
+    reports = []
+    reference_outputs = None
+
+    for backend in backends:
+        start = time.perf_counter()
+        try:
+            tokenizer, model = load_backend(name, backend)
+        except (RuntimeError, ImportError) as e:
+            logging.warning(f"Backend {backend} skipped: {str(e)}")
+            continue
+        load_time = time.perf_counter() - start
+
+        outputs, latencies = [], []
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt", max_length=max_input_tokens, truncation=True)
+            start = time.perf_counter()
+            output = model.generate(**inputs, **generation_kwargs)
+            latencies.append(time.perf_counter() - start)
+            outputs.append(tokenizer.decode(output[0], skip_special_tokens=True))
+
+        if reference_outputs is None:
+            reference_outputs = outputs
+        overlaps = [token_overlap(ref, out) for ref, out in zip(reference_outputs, outputs)]
+        reports.append({
+            "backend": backend,
+            "load_time_s": round(load_time, 2),
+            "size_mb": round(model_size_bytes(model) / 1024 ** 2, 1),
+            "mean_latency_s": round(sum(latencies) / len(latencies), 3),
+            "max_latency_s": round(max(latencies), 3),
+            "overlap_with_reference": round(sum(overlaps) / len(overlaps), 3),
+        })
+        del model
+    return reports
+
+
+if __name__ == "__main__":
+    from pdfminer.high_level import extract_text
+
+    from document_tasks import DECODING_PROFILES, DEFAULT_MODEL, build_prompt
+
+    parser = argparse.ArgumentParser(description="Compare the latency and outputs of the inference backends.")
+    parser.add_argument("pdfs", nargs="+", help="PDF files used as inputs")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--profile", default="fast", choices=sorted(DECODING_PROFILES))
+    parser.add_argument("--task", default="summarize", choices=["summarize", "describe"])
+    args = parser.parse_args()
+
+    prompts = [build_prompt(extract_text(pdf), args.task) for pdf in args.pdfs]
+    reports = compare_backends(args.model, prompts, args.backends, DECODING_PROFILES[args.profile])
+
+    print(f"{'backend':<14} {'load (s)':>9} {'size (MB)':>10} {'mean (s)':>9} {'max (s)':>8} {'overlap':>8}")
+    for report in reports:
+        print(
+            f"{report['backend']:<14} {report['load_time_s']:>9} {report['size_mb']:>10} "
+            f"{report['mean_latency_s']:>9} {report['max_latency_s']:>8} {report['overlap_with_reference']:>8}"
+        )
@@ -0,0 +1,146 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from metrics import LatencyStats
+
+
+@dataclass
+class _Request:
+    prompt: str
+    key: tuple
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+class InferenceScheduler:
+    """
+    Collects concurrent generate calls into padded batches.
+
+    Prompts are queued by `submit`. A background thread takes the oldest prompt, then waits at
+    most `max_wait_ms` for other prompts sharing the same model and generation parameters, up
+    to `max_batch_size`. The batch goes through a single `generate` call and each decoded output
+    is routed back to the future of the request that sent it.
+    """
+
+    def __init__(self, registry, max_batch_size=8, max_wait_ms=50, max_input_tokens=1024):
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_input_tokens = max_input_tokens
+
+        self._queue = queue.Queue()
+        # Requests taken off the queue that did not match the batch being built.
+        self._deferred = deque()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self.batch_sizes = Counter()
+        self.wait_times = LatencyStats()
+
+    def submit(self, prompt, model_name, **generation_kwargs):
+        """
+        Queues a prompt for generation.
+
+        Args:
+            prompt (str): The full prompt given to the model.
+            model_name (str): The registry name of the model to use.
+            **generation_kwargs: Parameters forwarded to `model.generate`.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the decoded output text.
+        """
+        self._ensure_started()
+        key = (model_name, tuple(sorted(generation_kwargs.items())))
+        request = _Request(prompt=prompt, key=key)
+        self._queue.put(request)
+        return request.future
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+                self._thread.start()
+
+    def _next_request(self):
+        if self._deferred:
+            return self._deferred.popleft()
+        return self._queue.get()
+
+    def _collect_batch(self):
+        first = self._next_request()
+        batch = [first]
+
+        # Deferred requests are older than anything still queued, take matching ones first.
+        for request in list(self._deferred):
+            if len(batch) == self.max_batch_size:
+                break
+            if request.key == first.key:
+                self._deferred.remove(request)
+                batch.append(request)
+
+        # Once the deadline has passed, only requests already waiting in the queue are taken.
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(block=remaining > 0, timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if request.key == first.key:
+                batch.append(request)
+            else:
+                self._deferred.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            if batch:
+                self._execute(batch)
+
+    def _execute(self, batch):
+        started = time.perf_counter()
+        for request in batch:
+            self.wait_times.record(started - request.enqueued)
+        self.batch_sizes[len(batch)] += 1
+
+        model_name, generation_kwargs = batch[0].key
+        try:
+            loaded = self.registry.get(model_name)
+            tokenizer, model = loaded.tokenizer, loaded.model
+            inputs = tokenizer(
+                [request.prompt for request in batch],
+                return_tensors="pt",
+                padding=True,
+                max_length=self.max_input_tokens,
+                truncation=True,
+            )
+            output = model.generate(**inputs, **dict(generation_kwargs))
+            texts = tokenizer.batch_decode(output, skip_special_tokens=True)
+        except Exception as e:
+            logging.error(f"Batched generation failed: {str(e)}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, text in zip(batch, texts):
+            request.future.set_result(text)
+
+    def queue_depth(self):
+        return self._queue.qsize() + len(self._deferred)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": sum(self.batch_sizes.values()),
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "wait_time": self.wait_times.summary(),
+        }
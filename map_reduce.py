@@ -0,0 +1,195 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?;:])\s+")
+
+
+def iter_paragraphs(text):
+    """Yields the non-empty paragraphs of a text without splitting it all at once."""
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        paragraph = text[start:match.start()].strip()
+        if paragraph:
+            yield paragraph
+        start = match.end()
+    paragraph = text[start:].strip()
+    if paragraph:
+        yield paragraph
+
+
+def _split_oversized(paragraph, count_tokens, max_tokens):
+    """Splits a paragraph longer than the budget on sentences, then on words as a last resort."""
+    for sentence in SENTENCE_BREAK.split(paragraph):
+        n_tokens = count_tokens(sentence)
+        if n_tokens <= max_tokens:
+            yield sentence, n_tokens
+            continue
+        words = sentence.split()
+        # Keep a margin as the token/word ratio is only an average.
+        words_per_piece = max(1, int(len(words) * max_tokens / n_tokens * 0.9))
+        for i in range(0, len(words), words_per_piece):
+            piece = " ".join(words[i:i + words_per_piece])
+            yield piece, count_tokens(piece)
+
+
+def iter_chunks(text, count_tokens, max_tokens):
+    """
+    Groups paragraphs into chunks of at most `max_tokens` tokens.
+
+    Chunks are cut on paragraph boundaries; only a paragraph that is longer than the budget on
+    its own is cut on sentences.
+    """
+    buffer, size = [], 0
+    for paragraph in iter_paragraphs(text):
+        n_tokens = count_tokens(paragraph)
+        pieces = [(paragraph, n_tokens)] if n_tokens <= max_tokens else _split_oversized(paragraph, count_tokens, max_tokens)
+        for piece, n_tokens in pieces:
+            if buffer and size + n_tokens > max_tokens:
+                yield "\n\n".join(buffer)
+                buffer, size = [], 0
+            buffer.append(piece)
+            size += n_tokens
+    if buffer:
+        yield "\n\n".join(buffer)
+
+
+class ChunkCache:
+    """Bounded LRU of chunk summaries, keyed by the chunk content and the generation settings."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text, namespace):
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class MapReduceSummarizer:
+    """
+    Condenses a text of any length until it fits in a single model input.
+
+    The text is cut into token-bounded chunks that are summarized concurrently (at most
+    `max_in_flight` at a time), and the partial summaries are reduced level by level as they
+    arrive, so memory stays bounded by the window and the depth of the reduction tree rather
+    than by the length of the document.
+
+    Args:
+        summarize (callable): Takes a passage and returns a Future resolving to its summary.
+        count_tokens (callable): Returns the number of tokens of a text.
+        max_tokens (int): Token budget of a single model input.
+        max_in_flight (int): Maximum number of chunk summaries pending at once.
+        cache (ChunkCache): Optional cache of chunk summaries, shared between documents.
+        cache_namespace (str): Identifies the model and settings the cached summaries come from.
+    """
+
+    def __init__(self, summarize, count_tokens, max_tokens, max_in_flight=8, cache=None, cache_namespace=""):
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.max_in_flight = max_in_flight
+        self.cache = cache
+        self.cache_namespace = cache_namespace
+        self.chunks = 0
+        self.reductions = 0
+
+    def condense(self, text):
+        """Returns `text` unchanged if it fits in the budget, a reduced summary of it otherwise."""
+        chunks = iter_chunks(text, self.count_tokens, self.max_tokens)
+        first = next(chunks, "")
+        second = next(chunks, None)
+        if second is None:
+            return text
+
+        levels = []
+        for summary in self._map(self._prepend((first, second), chunks)):
+            self._push(levels, 0, summary)
+        return self._flush(levels)
+
+    @staticmethod
+    def _prepend(head, chunks):
+        yield from head
+        yield from chunks
+
+    def _submit(self, chunk):
+        self.chunks += 1
+        if self.cache is None:
+            return self.summarize(chunk)
+
+        key = ChunkCache.key(chunk, self.cache_namespace)
+        cached = self.cache.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+
+        def store(done):
+            if not done.cancelled() and done.exception() is None:
+                self.cache.put(key, done.result())
+
+        future = self.summarize(chunk)
+        future.add_done_callback(store)
+        return future
+
+    def _map(self, chunks):
+        window = deque()
+        for chunk in chunks:
+            window.append(self._submit(chunk))
+            if len(window) >= self.max_in_flight:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+    def _reduce(self, summaries):
+        self.reductions += 1
+        return self._submit("\n\n".join(summaries)).result()
+
+    def _push(self, levels, level, summary):
+        if level == len(levels):
+            levels.append([[], 0])
+        buffer, size = levels[level]
+        n_tokens = self.count_tokens(summary)
+        if buffer and size + n_tokens > self.max_tokens:
+            merged = self._reduce(buffer)
+            levels[level] = [[summary], n_tokens]
+            self._push(levels, level + 1, merged)
+        else:
+            buffer.append(summary)
+            levels[level][1] = size + n_tokens
+
+    def _flush(self, levels):
+        level = 0
+        while level < len(levels) - 1:
+            buffer, _ = levels[level]
+            if buffer:
+                self._push(levels, level + 1, self._reduce(buffer))
+            level += 1
+        return "\n\n".join(levels[-1][0])
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from inference_backends import load_backend, model_size_bytes
+
+
+@dataclass
+class LoadedModel:
+    name: str
+    backend: str
+    tokenizer: object
+    model: object
+    load_time: float
+    resident_bytes: int
+    last_used: float = field(default_factory=time.time)
+
+
+class ModelRegistry:
+    """
+    Keeps tokenizers and seq2seq models resident for the lifetime of the process.
+
+    Models are loaded on first use (or explicitly at startup), warmed up with a dummy
+    generate call and shared by every request. When the total resident size goes over
+    the memory budget, the least recently used models are evicted.
+
+    The same model can be resident once per inference backend (see inference_backends).
+    """
+
+    def __init__(self, memory_budget_mb=None, default_backend="pytorch-fp32"):
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024) if memory_budget_mb else None
+        self.default_backend = default_backend
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, name, backend=None):
+        """
+        Returns the loaded model registered under `name`, loading it if needed.
+
+        Args:
+            name (str): The Hugging Face model name or local path.
+            backend (str): The inference backend, the registry default if None.
+
+        Returns:
+            LoadedModel: The resident tokenizer and model.
+        """
+        key = (name, backend or self.default_backend)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                entry.last_used = time.time()
+                return entry
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model, the others wait for it.
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(key)
+            if entry is None:
+                entry = self._load(*key)
+                with self._lock:
+                    self._models[key] = entry
+                    self._evict(keep=key)
+            return entry
+
+    def _load(self, name, backend):
+        start = time.perf_counter()
+        tokenizer, model = load_backend(name, backend)
+        self._warmup(tokenizer, model)
+        load_time = time.perf_counter() - start
+
+        entry = LoadedModel(
+            name=name,
+            backend=backend,
+            tokenizer=tokenizer,
+            model=model,
+            load_time=load_time,
+            resident_bytes=model_size_bytes(model),
+        )
+        logging.info(f"Model {name} ({backend}) loaded in {load_time:.1f}s ({entry.resident_bytes / 1024 ** 2:.0f} MB)")
+        return entry
+
+    @staticmethod
+    def _warmup(tokenizer, model):
+        inputs = tokenizer("Warm up.", return_tensors="pt")
+        model.generate(**inputs, max_new_tokens=1)
+
+    def _evict(self, keep):
+        if self.memory_budget_bytes is None:
+            return
+        total = sum(entry.resident_bytes for entry in self._models.values())
+        for key in list(self._models):
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            evicted = self._models.pop(key)
+            total -= evicted.resident_bytes
+            logging.info(f"Model {evicted.name} ({evicted.backend}) evicted to stay under the memory budget")
+        if total > self.memory_budget_bytes:
+            logging.warning(f"Model {keep[0]} ({keep[1]}) alone exceeds the memory budget of {self.memory_budget_bytes} bytes")
+
+    def unload(self, name, backend=None):
+        with self._lock:
+            self._models.pop((name, backend or self.default_backend), None)
+
+    def stats(self):
+        with self._lock:
+            models = [
+                {
+                    "name": entry.name,
+                    "backend": entry.backend,
+                    "load_time_s": round(entry.load_time, 3),
+                    "resident_mb": round(entry.resident_bytes / 1024 ** 2, 1),
+                    "last_used": entry.last_used,
+                }
+                for entry in self._models.values()
+            ]
+        return {
+            "default_backend": self.default_backend,
+            "memory_budget_mb": self.memory_budget_bytes / 1024 ** 2 if self.memory_budget_bytes else None,
+            "resident_mb": round(sum(model["resident_mb"] for model in models), 1),
+            "models": models,
+        }
@@ -1,14 +1,215 @@
 import os
 from pathlib import Path
 import PyPDF2
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
 from sklearn.pipeline import Pipeline
 from sklearn.svm import LinearSVC
 import numpy as np
+from scipy.sparse import vstack
 import shutil
+import hashlib
+import json
+import time
+import zlib
+import joblib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+
+# Version du format de l'artefact sauvegardé, à incrémenter si sa structure change
+MODEL_VERSION = 4
+# Seuil de confiance en dessous duquel un classement est jugé peu fiable
+CONFIDENCE_THRESHOLD = 0.4
+# Plage de recherche de la température de calibration; un optimum au-delà est ramené sur la borne
+TEMPERATURE_BOUNDS = (0.01, 100.0)
+# Nombre de plis de la validation croisée dont les scores servent à calibrer le modèle entraîné par train()
+CALIBRATION_FOLDS = 5
+# Lecture progressive: pages lues avant le premier classement, et confiance suffisante pour s'arrêter
+PROGRESSIVE_FIRST_PAGES = 2
+PROGRESSIVE_THRESHOLD = 0.8
+# Entraînement en flux: un document sur VALIDATION_EVERY (choisi d'après son nom) est mis de côté pour la calibration, dont un
+# échantillon de MAX_VALIDATION_DOCS vecteurs est conservé, et la taille de l'espace de hachage fixe la mémoire du modèle
+VALIDATION_EVERY = 10
+MAX_VALIDATION_DOCS = 1000
+HASHING_FEATURES = 2 ** 20
+
+
+@dataclass
+class Prediction:
+    label: str
+    confidence: float
+    # Les classes suivantes les plus probables, sous forme de (catégorie, probabilité)
+    alternatives: list = field(default_factory=list)
+
+    @property
+    def is_reliable(self):
+        return self.confidence >= CONFIDENCE_THRESHOLD
+
+
+@dataclass
+class ReadingReport:
+    pages_read: int
+    pages_total: int
+    seconds: float
+
+    @property
+    def seconds_saved(self):
+        """Temps d'extraction évité, estimé d'après le temps moyen par page lue"""
+        if not self.pages_read:
+            return 0.0
+        return self.seconds / self.pages_read * (self.pages_total - self.pages_read)
+
+
+def softmax(scores):
+    exp_scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return exp_scores / exp_scores.sum(axis=1, keepdims=True)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Empreinte SHA-256 du contenu d'un fichier, lu par blocs"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_pdf_files(folder):
+    """Parcourir les PDF d'un dossier au fil de l'eau, sans construire la liste complète"""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                yield entry.path
+
+
+# Empreintes des fichiers déjà classés, transmises une fois à chaque processus du pool
+_known_hashes = frozenset()
+# Classificateur utilisé par les processus du pool pour la lecture progressive (None: lecture complète)
+_progressive_classifier = None
+
+
+def _init_worker(known_hashes, progressive_classifier=None):
+    global _known_hashes, _progressive_classifier
+    _known_hashes = known_hashes
+    _progressive_classifier = progressive_classifier
+
+
+def _extract_job(pdf_path, known_hashes=None, progressive_classifier=None):
+    """Calculer l'empreinte d'un PDF puis extraire son texte, sauf s'il est déjà classé (texte None)
+
+    Renvoie (chemin, empreinte, texte, rapport de lecture, prédiction). Le rapport et la prédiction ne
+    sont remplis qu'en lecture progressive, où le document est déjà classé pendant la lecture.
+    """
+    if known_hashes is None:
+        known_hashes, progressive_classifier = _known_hashes, _progressive_classifier
+    digest = file_sha256(pdf_path)
+    if digest in known_hashes:
+        return pdf_path, digest, None, None, None
+    if progressive_classifier is not None:
+        text, prediction, reading = progressive_classifier.extract_text_progressively(pdf_path)
+        return pdf_path, digest, text, reading, prediction
+    return pdf_path, digest, PDFDocumentClassifier.extract_text_from_pdf(pdf_path), None, None
+
+
+def list_pdf_names(folder):
+    """Noms des PDF d'un dossier, triés: contrairement à os.scandir, l'ordre ne dépend pas du système de fichiers"""
+    with os.scandir(folder) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file() and entry.name.lower().endswith('.pdf'))
+
+
+def is_held_out(category, pdf_path):
+    """Un document sur VALIDATION_EVERY, tiré de son nom: le même à chaque passe, et après une reprise"""
+    return zlib.crc32(f"{category}/{os.path.basename(pdf_path)}".encode('utf-8')) % VALIDATION_EVERY == 0
+
+
+def iter_labelled_pdfs(archive_folder, categories, resume_after=None):
+    """Parcourir une archive rangée par catégorie (<archive>/<catégorie>/*.pdf) en alternant les catégories
+
+    Chaque catégorie est lue dans l'ordre des noms de fichiers, et les catégories sont entrelacées pour que
+    chaque mini-lot en mélange plusieurs. `resume_after` donne, par catégorie, le dernier nom déjà appris:
+    la reprise ne repose pas sur une position, que l'ajout ou la suppression d'un fichier décalerait.
+    """
+    resume_after = resume_after or {}
+    streams = []
+    for category in sorted(categories):
+        folder = os.path.join(archive_folder, category)
+        if not os.path.isdir(folder):
+            continue
+        names = [name for name in list_pdf_names(folder) if name > resume_after.get(category, '')]
+        streams.append((category, folder, iter(names)))
+    while streams:
+        for stream in list(streams):
+            category, folder, names = stream
+            name = next(names, None)
+            if name is None:
+                streams.remove(stream)
+            else:
+                yield os.path.join(folder, name), category
+
+
+class ValidationReservoir:
+    """Échantillon uniforme et borné des documents de validation, conservés sous forme de vecteurs hachés
+
+    Les textes ne sont pas gardés: au-delà de `size` documents, chaque nouveau vecteur remplace un vecteur
+    tiré au hasard (échantillonnage par réservoir), ce qui borne la mémoire quelle que soit la taille de l'archive.
+    """
+
+    def __init__(self, size, seed):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.vectors = []
+        self.labels = []
+        self.seen = 0
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def add(self, vectors, labels):
+        for row, label in enumerate(labels):
+            self.seen += 1
+            if len(self.vectors) < self.size:
+                self.vectors.append(vectors[row])
+                self.labels.append(label)
+                continue
+            slot = self.rng.integers(self.seen)
+            if slot < self.size:
+                self.vectors[slot] = vectors[row]
+                self.labels[slot] = label
+
+    def matrix(self):
+        return vstack(self.vectors)
+
+
+class ProgressReporter:
+    """Afficher périodiquement le débit et le temps restant estimé"""
+
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, count=1):
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else float('inf')
+        eta = f"{remaining / 60:.1f} min" if remaining != float('inf') else "?"
+        print(f"Progression: {self.done}/{self.total} fichiers ({rate:.1f} fichiers/s, reste ~{eta})")
 
 class PDFDocumentClassifier:
-    def __init__(self):
+    def __init__(self, model_path="pdf_classifier.joblib", seed=42):
+        self.model_path = model_path
+        self.seed = seed
+
         # Amélioration des mots-clés avec plus de termes pertinents et leur contexte
         self.categories = {
             'facture': [
@@ -45,8 +246,14 @@ class PDFDocumentClassifier:
             ]
         }
         
+        self.classifier = self._build_pipeline()
+        # Température de calibration des scores de décision, ajustée à l'entraînement
+        self.temperature = 1.0
+        self.is_trained = False
+
+    def _build_pipeline(self):
         # Amélioration du pipeline avec des paramètres optimisés
-        self.classifier = Pipeline([
+        return Pipeline([
             ('vectorizer', TfidfVectorizer(
                 ngram_range=(1, 3),  # Prend en compte les groupes de 1 à 3 mots
                 min_df=2,            # Ignore les termes trop rares
@@ -55,41 +262,101 @@ class PDFDocumentClassifier:
             )),
             ('classifier', LinearSVC(
                 C=1.0,               # Paramètre de régularisation
-                class_weight='balanced'  # Gestion des classes déséquilibrées
+                class_weight='balanced',  # Gestion des classes déséquilibrées
+                random_state=self.seed
             ))
         ])
-        
-        self.is_trained = False
 
-    def extract_text_from_pdf(self, pdf_path):
-        """Extraire le texte d'un fichier PDF avec gestion améliorée du texte"""
+    def _build_streaming_pipeline(self):
+        # Vectorisation sans vocabulaire (hachage) et apprentissage incrémental: mémoire indépendante du corpus
+        return Pipeline([
+            ('vectorizer', HashingVectorizer(
+                ngram_range=(1, 3),
+                n_features=HASHING_FEATURES,
+                alternate_sign=False,
+                norm='l2'
+            )),
+            ('classifier', SGDClassifier(
+                loss='hinge',        # Même objectif qu'un SVM linéaire
+                alpha=1e-5,
+                random_state=self.seed
+            ))
+        ])
+
+    def categories_fingerprint(self):
+        """Empreinte des catégories et de leurs mots-clés, pour détecter un modèle sauvegardé obsolète"""
+        payload = json.dumps(self.categories, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _page_text(page):
+        """Extraire le texte d'une page avec nettoyage basique"""
+        page_text = page.extract_text()
+        if not page_text:
+            return ""
+        # Normalisation du texte
+        return ' '.join(page_text.split()).lower() + "\n"  # Normalise les espaces
+
+    @staticmethod
+    def extract_text_from_pdf(pdf_path, max_pages=None):
+        """Extraire le texte d'un fichier PDF avec gestion améliorée du texte
+
+        Seules les `max_pages` premières pages sont lues si la limite est donnée.
+        """
         try:
             with open(pdf_path, 'rb') as file:
                 reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in reader.pages:
-                    # Extraction du texte avec nettoyage basique
-                    page_text = page.extract_text()
-                    if page_text:
-                        # Normalisation du texte
-                        page_text = ' '.join(page_text.split())  # Normalise les espaces
-                        text += page_text + "\n"
-                return text.lower()
+                pages = reader.pages if max_pages is None else reader.pages[:max_pages]
+                return "".join(PDFDocumentClassifier._page_text(page) for page in pages)
         except Exception as e:
             print(f"Erreur lors de la lecture du PDF {pdf_path}: {str(e)}")
             return ""
 
+    def extract_text_progressively(self, pdf_path, first_pages=PROGRESSIVE_FIRST_PAGES, threshold=PROGRESSIVE_THRESHOLD):
+        """Extraire juste assez de pages pour classer un PDF avec confiance
+
+        Le document est classé d'après ses `first_pages` premières pages, puis le nombre de pages
+        lues double tant que la confiance reste sous `threshold` et qu'il reste des pages.
+
+        Returns:
+            tuple: Le texte lu, la Prediction obtenue (None si le PDF est illisible ou vide) et
+            le ReadingReport (pages lues, pages totales, durée).
+        """
+        if first_pages < 1:
+            raise ValueError(f"first_pages doit valoir au moins 1 (reçu {first_pages})")
+        start = time.perf_counter()
+        parts, prediction = [], None
+        try:
+            with open(pdf_path, 'rb') as file:
+                reader = PyPDF2.PdfReader(file)
+                pages_total = len(reader.pages)
+                limit = first_pages
+                while len(parts) < pages_total:
+                    parts.extend(self._page_text(page) for page in reader.pages[len(parts):limit])
+                    text = "".join(parts)
+                    if text:
+                        prediction = self.predict_many([text])[0]
+                        if prediction.confidence >= threshold:
+                            break
+                    limit *= 2
+        except Exception as e:
+            print(f"Erreur lors de la lecture du PDF {pdf_path}: {str(e)}")
+            return "", None, ReadingReport(0, 0, time.perf_counter() - start)
+        return "".join(parts), prediction, ReadingReport(len(parts), pages_total, time.perf_counter() - start)
+
     def create_training_data(self):
         """Créer des données d'entraînement plus réalistes"""
         texts = []
         labels = []
+        # Générateur initialisé avec la graine pour un entraînement reproductible
+        rng = np.random.default_rng(self.seed)
         
         for category, keywords in self.categories.items():
             # Augmentation du nombre d'exemples par catégorie
             for _ in range(50):  # Plus d'exemples pour un meilleur apprentissage
                 # Création de textes plus réalistes
-                num_keywords = np.random.randint(5, 10)  # Plus de mots-clés par exemple
-                main_keywords = np.random.choice(keywords, size=num_keywords, replace=False)
+                num_keywords = rng.integers(5, 10)  # Plus de mots-clés par exemple
+                main_keywords = rng.choice(keywords, size=num_keywords, replace=False)
                 
                 # Ajout de bruit et de contexte
                 filler_words = ['le', 'la', 'les', 'du', 'des', 'un', 'une', 'et', 'pour', 'dans']
@@ -97,11 +364,11 @@ class PDFDocumentClassifier:
                 
                 for keyword in main_keywords:
                     # Ajout de mots de contexte autour des mots-clés
-                    if np.random.random() > 0.5:
-                        text_parts.append(np.random.choice(filler_words))
+                    if rng.random() > 0.5:
+                        text_parts.append(rng.choice(filler_words))
                     text_parts.append(keyword)
-                    if np.random.random() > 0.5:
-                        text_parts.append(np.random.choice(filler_words))
+                    if rng.random() > 0.5:
+                        text_parts.append(rng.choice(filler_words))
                 
                 text = ' '.join(text_parts)
                 texts.append(text.lower())
@@ -109,59 +376,372 @@ class PDFDocumentClassifier:
         
         return texts, labels
 
+    def predict_many(self, texts, top_k=3):
+        """Prédire la catégorie d'un lot de textes avec une probabilité calibrée
+
+        Le lot est vectorisé une seule fois et les scores de décision de toutes les classes sont
+        obtenus en un seul produit de matrices creuses, puis convertis en probabilités par un
+        softmax à la température ajustée à l'entraînement.
+
+        Returns:
+            list[Prediction]: Pour chaque texte, la catégorie, sa probabilité et les `top_k - 1`
+            catégories suivantes.
+        """
+        self.ensure_model()
+        if not texts:
+            return []
+
+        features = self.classifier[:-1].transform(texts)
+        decision_scores = self.classifier[-1].decision_function(features)
+        probabilities = softmax(decision_scores / self.temperature)
+        classes = self.classifier.classes_
+        ranking = np.argsort(-probabilities, axis=1)[:, :top_k]
+
+        predictions = []
+        for row, ranked in enumerate(ranking):
+            best, *others = ranked
+            predictions.append(Prediction(
+                label=classes[best],
+                confidence=float(probabilities[row, best]),
+                alternatives=[(classes[i], float(probabilities[row, i])) for i in others],
+            ))
+        return predictions
+
     def predict(self, text):
         """Prédire la catégorie d'un texte avec score de confiance"""
-        if not self.is_trained:
-            print("Le modèle n'est pas encore entraîné!")
-            return None
+        prediction = self.predict_many([text])[0]
         
-        # Obtenir les scores de décision pour chaque classe
-        decision_scores = self.classifier.decision_function([text])
-        predicted_class = self.classifier.predict([text])[0]
-        
-        # Convertir les scores en probabilités via softmax
-        scores = np.exp(decision_scores) / np.sum(np.exp(decision_scores), axis=1)[:, None]
-        confidence = np.max(scores)
-        
-        if confidence < 0.4:  # Seuil de confiance
-            print(f"Attention: Classification peu fiable (confidence: {confidence:.2f})")
+        if not prediction.is_reliable:
+            print(f"Attention: Classification peu fiable (confidence: {prediction.confidence:.2f})")
             
-        return predicted_class
+        return prediction.label
+
+    @staticmethod
+    def _fit_temperature(decision_scores, labels, classes):
+        """Choisir la température qui minimise l'entropie croisée sur les données de validation
+
+        Les cibles sont lissées comme dans la méthode de Platt: la classe correcte vaut (n + 1) / (n + 2),
+        n étant son nombre d'exemples, et le reste est réparti entre les autres classes. Sur des données
+        parfaitement séparées, l'optimum reste ainsi fini au lieu de tendre vers une température nulle.
+        Un optimum hors de TEMPERATURE_BOUNDS est ramené sur la borne atteinte.
+        """
+        targets = np.searchsorted(classes, labels)
+        counts = np.bincount(targets, minlength=len(classes))
+        true_probability = (counts[targets] + 1) / (counts[targets] + 2)
+        smoothed = np.repeat(((1 - true_probability) / (len(classes) - 1))[:, None], len(classes), axis=1)
+        smoothed[np.arange(len(targets)), targets] = true_probability
+
+        low, high = np.log10(TEMPERATURE_BOUNDS)
+        temperatures = np.logspace(low, high, 81)
+        losses = [
+            -np.mean(np.sum(smoothed * np.log(softmax(decision_scores / temperature) + 1e-12), axis=1))
+            for temperature in temperatures
+        ]
+        best = int(np.argmin(losses))
+        if best in (0, len(temperatures) - 1):
+            print(f"Calibration: optimum hors de la plage, température ramenée à {temperatures[best]:.2f}")
+        return float(temperatures[best])
 
     def train(self):
-        """Entraîner le classificateur"""
+        """Entraîner le classificateur, calibrer ses probabilités et sauvegarder le modèle"""
         texts, labels = self.create_training_data()
+        labels = np.array(labels)
+
+        # Calibration sur les scores de validation croisée: chaque exemple est noté par un modèle qui ne
+        # l'a pas vu, puis entraînement final sur tout le corpus
+        folds = StratifiedKFold(CALIBRATION_FOLDS, shuffle=True, random_state=self.seed)
+        held_out_scores = cross_val_predict(
+            self._build_pipeline(), texts, labels, cv=folds, method='decision_function'
+        )
+        self.classifier = self._build_pipeline()
         self.classifier.fit(texts, labels)
+        self.temperature = self._fit_temperature(held_out_scores, labels, self.classifier.classes_)
+        self.is_trained = True
+        print("Entraînement terminé!")
+        if self.model_path:
+            self.save()
+
+    def _save_checkpoint(self, checkpoint_path, epoch, cursors):
+        # Le réservoir de validation n'y figure pas: la taille du point de reprise ne dépend que du modèle
+        checkpoint = {
+            'version': MODEL_VERSION,
+            'fingerprint': self.categories_fingerprint(),
+            'pipeline': self.classifier,
+            'epoch': epoch,
+            # Dernier fichier appris de chaque catégorie entamée pendant la passe en cours
+            'cursors': cursors,
+        }
+        tmp_path = f"{checkpoint_path}.tmp"
+        joblib.dump(checkpoint, tmp_path)
+        os.replace(tmp_path, checkpoint_path)
+
+    def _load_checkpoint(self, checkpoint_path):
+        """Charger un point de reprise compatible, ou None"""
+        if not os.path.exists(checkpoint_path):
+            return None
+        try:
+            checkpoint = joblib.load(checkpoint_path)
+        except Exception as e:
+            print(f"Erreur lors du chargement du point de reprise {checkpoint_path}: {str(e)}")
+            return None
+        if checkpoint.get('version') != MODEL_VERSION or checkpoint.get('fingerprint') != self.categories_fingerprint():
+            print(f"Le point de reprise {checkpoint_path} est obsolète, entraînement repris du début")
+            return None
+        return checkpoint
+
+    def train_from_archive(self, archive_folder, epochs=1, batch_size=256, workers=None,
+                           checkpoint_path=None, checkpoint_every=20):
+        """Entraîner le classificateur en flux sur une archive de PDF étiquetés
+
+        Les documents sont lus par mini-lots de `batch_size` (textes extraits dans un pool de `workers`
+        processus), vectorisés par hachage et appris avec `partial_fit`: la mémoire ne dépend que de la
+        taille des lots et du réservoir de validation, pas de celle de l'archive. Un point de reprise est
+        écrit tous les `checkpoint_every` lots; s'il existe au lancement, l'entraînement reprend là où il
+        s'était arrêté, et le réservoir de validation est alors rempli à partir de ce point.
+
+        Args:
+            archive_folder (str): Dossier contenant un sous-dossier de PDF par catégorie.
+            epochs (int): Nombre de passes sur l'archive.
+        """
+        checkpoint_path = checkpoint_path or f"{self.model_path}.checkpoint"
+        classes = np.array(sorted(self.categories))
+        workers = workers or os.cpu_count() or 1
+
+        checkpoint = self._load_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            self.classifier = self._build_streaming_pipeline()
+            start_epoch, start_cursors = 0, {}
+        else:
+            self.classifier = checkpoint['pipeline']
+            start_epoch, start_cursors = checkpoint['epoch'], checkpoint['cursors']
+            print(f"Reprise de l'entraînement: passe {start_epoch + 1}, {len(start_cursors)} catégories entamées")
+        vectorizer, model = self.classifier[0], self.classifier[-1]
+        validation = ValidationReservoir(MAX_VALIDATION_DOCS, self.seed)
+
+        pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            for epoch in range(start_epoch, epochs):
+                batches = read = 0
+                cursors = dict(start_cursors) if epoch == start_epoch else {}
+                # Les documents déjà appris avant l'interruption sont passés
+                stream = iter_labelled_pdfs(archive_folder, self.categories, resume_after=dict(cursors))
+
+                while True:
+                    batch = [item for _, item in zip(range(batch_size), stream)]
+                    if not batch:
+                        break
+                    paths = [pdf_path for pdf_path, _ in batch]
+                    texts = pool.map(self.extract_text_from_pdf, paths) if pool else map(self.extract_text_from_pdf, paths)
+
+                    batch_texts, batch_labels, held_out_texts, held_out_labels = [], [], [], []
+                    for text, (pdf_path, category) in zip(texts, batch):
+                        if not text:
+                            continue
+                        if is_held_out(category, pdf_path):
+                            # Tenus à l'écart de l'apprentissage à chaque passe, échantillonnés à la première de l'exécution
+                            if epoch == start_epoch:
+                                held_out_texts.append(text)
+                                held_out_labels.append(category)
+                            continue
+                        batch_texts.append(text)
+                        batch_labels.append(category)
+                    for pdf_path, category in batch:
+                        cursors[category] = os.path.basename(pdf_path)
+                    read += len(batch)
+
+                    if batch_texts:
+                        model.partial_fit(vectorizer.transform(batch_texts), batch_labels, classes=classes)
+                    if held_out_texts:
+                        validation.add(vectorizer.transform(held_out_texts), held_out_labels)
+                    batches += 1
+                    if batches % checkpoint_every == 0:
+                        self._save_checkpoint(checkpoint_path, epoch, cursors)
+                        print(f"Passe {epoch + 1}: {read} documents lus")
+                self._save_checkpoint(checkpoint_path, epoch + 1, {})
+        finally:
+            if pool:
+                pool.shutdown()
+
+        if not hasattr(model, 'coef_'):
+            raise ValueError(f"Aucun document exploitable dans {archive_folder}")
+        if len(validation):
+            self.temperature = self._fit_temperature(
+                model.decision_function(validation.matrix()),
+                np.array(validation.labels),
+                model.classes_,
+            )
         self.is_trained = True
         print("Entraînement terminé!")
+        if self.model_path:
+            self.save()
+        os.remove(checkpoint_path)
+
+    def save(self, path=None):
+        """Sauvegarder le pipeline entraîné avec les catégories et leur empreinte"""
+        path = path or self.model_path
+        artifact = {
+            'version': MODEL_VERSION,
+            'fingerprint': self.categories_fingerprint(),
+            'categories': self.categories,
+            'seed': self.seed,
+            'pipeline': self.classifier,
+            'temperature': self.temperature,
+        }
+        # Écriture dans un fichier temporaire puis renommage, pour ne jamais laisser d'artefact partiel
+        tmp_path = f"{path}.tmp"
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"Modèle sauvegardé dans {path}")
+
+    def load(self, path=None):
+        """Charger un modèle sauvegardé, s'il existe et correspond aux catégories actuelles"""
+        path = path or self.model_path
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            artifact = joblib.load(path)
+        except Exception as e:
+            print(f"Erreur lors du chargement du modèle {path}: {str(e)}")
+            return False
 
-    def organize_pdfs(self, input_folder, output_folder):
-        """Organiser les PDF dans des dossiers par catégorie"""
-        if not self.is_trained:
+        if artifact.get('version') != MODEL_VERSION or artifact.get('fingerprint') != self.categories_fingerprint():
+            print(f"Le modèle {path} est obsolète (catégories ou format modifiés)")
+            return False
+
+        self.classifier = artifact['pipeline']
+        self.temperature = artifact['temperature']
+        self.is_trained = True
+        print(f"Modèle chargé depuis {path}")
+        return True
+
+    def ensure_model(self):
+        """Charger le modèle au premier besoin, et ne le réentraîner que s'il est absent ou obsolète"""
+        if self.is_trained:
+            return
+        if not self.load():
             print("Entraînement du modèle...")
             self.train()
 
+    @staticmethod
+    def _load_manifest(manifest_path):
+        """Lire les empreintes des fichiers déjà classés dans le manifeste"""
+        known = set()
+        if not os.path.exists(manifest_path):
+            return known
+        with open(manifest_path, encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    known.add(json.loads(line)['sha256'])
+                except (ValueError, KeyError):
+                    continue  # Ligne incomplète d'une exécution interrompue
+        return known
+
+    def _extract_all(self, input_folder, workers, known, progressive):
+        """Extraire les textes dans un pool de processus, avec un nombre borné de tâches en cours"""
+        # En lecture progressive, chaque processus reçoit une copie du modèle pour classer au fil des pages
+        progressive_classifier = self if progressive else None
+        if workers == 1:
+            for pdf_path in iter_pdf_files(input_folder):
+                yield _extract_job(pdf_path, known, progressive_classifier)
+            return
+
+        max_in_flight = 4 * workers
+        initargs = (frozenset(known), progressive_classifier)
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+            pending = set()
+            for pdf_path in iter_pdf_files(input_folder):
+                pending.add(pool.submit(_extract_job, pdf_path))
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in as_completed(pending):
+                yield future.result()
+
+    def _classify_and_copy(self, batch, output_folder, manifest):
+        """Classer un lot, copier les fichiers et les inscrire au manifeste; renvoie le nombre de classements peu fiables
+
+        Les documents déjà classés par le processus qui les a lus (lecture progressive) gardent cette prédiction.
+        """
+        low_confidence = 0
+        predicted = iter(self.predict_many([text for _, _, text, _, prediction in batch if prediction is None]))
+        for pdf_path, digest, _, reading, prediction in batch:
+            if prediction is None:
+                prediction = next(predicted)
+            filename = os.path.basename(pdf_path)
+            shutil.copy2(pdf_path, os.path.join(output_folder, prediction.label, filename))
+            entry = {
+                'sha256': digest,
+                'file': filename,
+                'category': prediction.label,
+                'confidence': round(prediction.confidence, 4),
+            }
+            if reading is not None:
+                entry.update(pages_read=reading.pages_read, pages_total=reading.pages_total,
+                             seconds_saved=round(reading.seconds_saved, 3))
+            manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            if not prediction.is_reliable:
+                low_confidence += 1
+        manifest.flush()
+        return low_confidence
+
+    def organize_pdfs(self, input_folder, output_folder, workers=None, batch_size=64, manifest_path=None,
+                      progressive=False):
+        """Organiser les PDF dans des dossiers par catégorie
+
+        Le texte est extrait dans un pool de `workers` processus (1 pour tout faire dans le processus
+        courant) et classé par lots de `batch_size`. Le manifeste (empreinte du contenu -> catégorie,
+        confiance) permet d'ignorer les fichiers déjà classés lors d'une nouvelle exécution.
+
+        Avec `progressive`, seules les pages nécessaires à un classement confiant sont lues (voir
+        extract_text_progressively) et le manifeste indique les pages lues et le temps économisé.
+        """
+        self.ensure_model()
+
         os.makedirs(output_folder, exist_ok=True)
         
         for category in self.categories.keys():
             os.makedirs(os.path.join(output_folder, category), exist_ok=True)
 
-        processed_files = 0
-        for filename in os.listdir(input_folder):
-            if filename.lower().endswith('.pdf'):
-                pdf_path = os.path.join(input_folder, filename)
-                print(f"\nTraitement de {filename}...")
-                
-                text = self.extract_text_from_pdf(pdf_path)
-                if text:
-                    category = self.predict(text)
-                    destination = os.path.join(output_folder, category, filename)
-                    shutil.copy2(pdf_path, destination)
-                    
-                    print(f"Classé comme: {category}")
-                    processed_files += 1
-
-        print(f"\nClassification terminée! {processed_files} fichiers traités.")
+        manifest_path = manifest_path or os.path.join(output_folder, 'manifest.jsonl')
+        known = self._load_manifest(manifest_path)
+        workers = workers or os.cpu_count() or 1
+        progress = ProgressReporter(total=sum(1 for _ in iter_pdf_files(input_folder)))
+
+        processed_files = skipped_files = failed_files = low_confidence = 0
+        pages_read = pages_total = 0
+        seconds_saved = 0.0
+        batch = []
+        with open(manifest_path, 'a', encoding='utf-8') as manifest:
+            for pdf_path, digest, text, reading, prediction in self._extract_all(input_folder, workers, known, progressive):
+                progress.update()
+                if text is None or digest in known:
+                    skipped_files += 1
+                    continue
+                if not text:
+                    failed_files += 1
+                    continue
+                if reading is not None:
+                    pages_read += reading.pages_read
+                    pages_total += reading.pages_total
+                    seconds_saved += reading.seconds_saved
+                batch.append((pdf_path, digest, text, reading, prediction))
+                # Marqué dès l'ajout au lot: un doublon du même lot est ignoré au lieu d'être classé et copié deux fois
+                known.add(digest)
+                if len(batch) >= batch_size:
+                    low_confidence += self._classify_and_copy(batch, output_folder, manifest)
+                    processed_files += len(batch)
+                    batch = []
+            if batch:
+                low_confidence += self._classify_and_copy(batch, output_folder, manifest)
+                processed_files += len(batch)
+
+        progress.report()
+        print(f"\nClassification terminée! {processed_files} fichiers traités, "
+              f"{skipped_files} déjà classés, {failed_files} illisibles, {low_confidence} peu fiables.")
+        if progressive:
+            print(f"Lecture progressive: {pages_read}/{pages_total} pages lues, "
+                  f"~{seconds_saved:.1f}s d'extraction économisées.")
 
 if __name__ == "__main__":
     classifier = PDFDocumentClassifier()
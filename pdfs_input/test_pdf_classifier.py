@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+import numpy as np
+
+from pdf_classifier import CONFIDENCE_THRESHOLD, TEMPERATURE_BOUNDS, PDFDocumentClassifier, iter_labelled_pdfs
+
+
+def test_nonsense_is_low_confidence():
+    # Sans chemin de modèle: entraînement en mémoire, rien n'est écrit sur le disque
+    classifier = PDFDocumentClassifier(model_path=None)
+    for prediction in classifier.predict_many(["bonjour", "xyz qwerty"]):
+        assert prediction.confidence < CONFIDENCE_THRESHOLD
+        assert not prediction.is_reliable
+
+
+def test_keywords_are_reliable():
+    classifier = PDFDocumentClassifier(model_path=None)
+    prediction = classifier.predict_many(["facture numéro de facture total ttc tva montant client"])[0]
+    assert prediction.label == 'facture'
+    assert prediction.is_reliable
+
+
+def test_temperature_on_separable_validation():
+    # Validation parfaitement séparée: les cibles lissées gardent un optimum fini, à l'intérieur de la plage
+    classes = np.array(['a', 'b', 'c'])
+    scores = np.eye(3) * 5 - 1
+    temperature = PDFDocumentClassifier._fit_temperature(scores, classes, classes)
+    assert TEMPERATURE_BOUNDS[0] < temperature < TEMPERATURE_BOUNDS[1]
+    # La classe correcte vaut 2/3 pour une cible lissée avec un exemple par classe: T = 5 / ln 4
+    assert abs(temperature - 5 / np.log(4)) / temperature < 0.1
+
+
+def test_temperature_clamped_to_upper_bound():
+    # Scores confiants mais faux: la validation réclame des probabilités plus plates, pas un retour à T=1
+    classes = np.array(['a', 'b', 'c'])
+    scores = np.eye(3) * 5 - 1
+    temperature = PDFDocumentClassifier._fit_temperature(scores, np.array(['b', 'c', 'a']), classes)
+    assert temperature == TEMPERATURE_BOUNDS[1]
+
+
+def test_trained_temperature_sharpens_probabilities():
+    # La température ajustée sur les scores de validation croisée n'est ni la valeur neutre ni une borne
+    classifier = PDFDocumentClassifier(model_path=None)
+    classifier.ensure_model()
+    assert TEMPERATURE_BOUNDS[0] < classifier.temperature < 1.0
+
+
+def test_resume_after_archive_changes():
+    # La reprise suit le dernier nom appris par catégorie: ajouts et suppressions ne décalent rien
+    with tempfile.TemporaryDirectory() as archive:
+        for category, names in {'cv': ['c.pdf', 'a.pdf', 'e.pdf'], 'facture': ['b.pdf', 'd.pdf']}.items():
+            os.makedirs(os.path.join(archive, category))
+            for name in names:
+                open(os.path.join(archive, category, name), 'wb').close()
+
+        def read(resume_after=None):
+            return [(category, os.path.basename(path))
+                    for path, category in iter_labelled_pdfs(archive, ['facture', 'cv'], resume_after)]
+
+        assert read() == [('cv', 'a.pdf'), ('facture', 'b.pdf'), ('cv', 'c.pdf'), ('facture', 'd.pdf'), ('cv', 'e.pdf')]
+
+        os.remove(os.path.join(archive, 'cv', 'a.pdf'))
+        open(os.path.join(archive, 'cv', 'aa.pdf'), 'wb').close()
+        open(os.path.join(archive, 'cv', 'f.pdf'), 'wb').close()
+        assert read({'cv': 'c.pdf', 'facture': 'b.pdf'}) == [('cv', 'e.pdf'), ('facture', 'd.pdf'), ('cv', 'f.pdf')]
+
+
+if __name__ == "__main__":
+    test_nonsense_is_low_confidence()
+    test_keywords_are_reliable()
+    test_temperature_on_separable_validation()
+    test_temperature_clamped_to_upper_bound()
+    test_trained_temperature_sharpens_probabilities()
+    test_resume_after_archive_changes()
+    print("OK")
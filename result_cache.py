@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Two-tier cache of generated results, keyed by the content of the uploaded document.
+
+    The in-memory tier is an LRU bounded by a number of entries. The optional on-disk tier
+    stores one small JSON file per entry and evicts the least recently used files once its
+    total size goes over `disk_max_bytes`. A disk hit is promoted to the memory tier.
+    """
+
+    def __init__(self, max_entries=256, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in self._disk_entries())
+
+    @staticmethod
+    def make_key(digest, task, model_name, generation_kwargs, **options):
+        """
+        Builds the cache key of a result.
+
+        Args:
+            digest (str): SHA-256 hex digest of the uploaded bytes.
+            task (str): The task performed on the document.
+            model_name (str): The name of the model producing the result.
+            generation_kwargs (dict): The parameters given to `generate`.
+            **options: Any other setting that changes the result.
+
+        Returns:
+            str: A SHA-256 hex digest identifying the result.
+        """
+        payload = json.dumps(
+            {"digest": digest, "task": task, "model": model_name, "generation": generation_kwargs, "options": options},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self._memory[key]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+        self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.counters["memory_evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_entries(self):
+        return [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".json")]
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                value = json.load(f)["value"]
+            # The modification time orders the files for eviction.
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Unreadable cache entry {path}: {str(e)}")
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            with tempfile.NamedTemporaryFile("w", dir=self.disk_dir, suffix=".tmp", delete=False, encoding="utf-8") as tmp:
+                json.dump({"value": value}, tmp, ensure_ascii=False)
+            size = os.path.getsize(tmp.name)
+            os.replace(tmp.name, path)
+        except OSError as e:
+            logging.warning(f"Could not write cache entry {path}: {str(e)}")
+            return
+
+        with self._lock:
+            self._disk_bytes += size - previous
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_evict()
+
+    def _disk_evict(self):
+        entries = sorted(self._disk_entries(), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "disk_mb": round(self._disk_bytes / 1024 ** 2, 2) if self.disk_dir else None,
+            }
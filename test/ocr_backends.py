@@ -0,0 +1,172 @@
+import argparse
+import logging
+import time
+from collections import Counter
+
+OCR_BACKENDS = ("tesserocr", "pytesseract")
+
+
+class PytesseractBackend:
+    """OCR par l'exécutable tesseract: un processus et une image temporaire par page"""
+
+    name = "pytesseract"
+
+    def __init__(self, lang="fra"):
+        # Importé ici: le backend tesserocr reste utilisable sans pytesseract
+        try:
+            import pytesseract
+        except ImportError:
+            raise RuntimeError("Le backend pytesseract nécessite le paquet pytesseract: pip install pytesseract")
+        self._pytesseract = pytesseract
+        self.config = f"--oem 3 --psm 6 -l {lang}"
+
+    def image_to_words(self, image):
+        pytesseract = self._pytesseract
+        data = pytesseract.image_to_data(image, config=self.config, output_type=pytesseract.Output.DICT)
+
+        words = []
+        for i in range(len(data['text'])):
+            word = data['text'][i].strip()
+            if word:
+                words.append({
+                    'text': word,
+                    'left': data['left'][i],
+                    'top': data['top'][i],
+                    'width': data['width'][i],
+                    'height': data['height'][i]
+                })
+        return words
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend:
+    """OCR par l'API C de Tesseract: le moteur et les données de langue restent chargés entre les pages"""
+
+    name = "tesserocr"
+
+    def __init__(self, lang="fra"):
+        try:
+            import tesserocr
+        except ImportError:
+            raise RuntimeError("Le backend tesserocr nécessite le paquet tesserocr: pip install tesserocr")
+        self._tesserocr = tesserocr
+        # Mêmes réglages que le chemin pytesseract (--oem 3 --psm 6)
+        self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.SINGLE_BLOCK, oem=tesserocr.OEM.DEFAULT)
+
+    def image_to_words(self, image):
+        # L'image PIL est transmise en mémoire, sans fichier temporaire
+        self._api.SetImage(image)
+        self._api.Recognize()
+        iterator = self._api.GetIterator()
+        if iterator is None:
+            return []
+
+        level = self._tesserocr.RIL.WORD
+        words = []
+        for result in self._tesserocr.iterate_level(iterator, level):
+            word = (result.GetUTF8Text(level) or "").strip()
+            box = result.BoundingBox(level)
+            if word and box:
+                left, top, right, bottom = box
+                words.append({
+                    'text': word,
+                    'left': left,
+                    'top': top,
+                    'width': right - left,
+                    'height': bottom - top
+                })
+        return words
+
+    def close(self):
+        if self._api is not None:
+            self._api.End()
+            self._api = None
+
+
+def load_ocr_backend(name=None, lang="fra"):
+    """Créer un moteur OCR réutilisable; sans nom, tesserocr s'il est installé, pytesseract sinon"""
+    if name is None:
+        try:
+            return TesserocrBackend(lang)
+        except RuntimeError as e:
+            logging.warning(f"{str(e)}, utilisation de pytesseract")
+            return PytesseractBackend(lang)
+    if name == "tesserocr":
+        return TesserocrBackend(lang)
+    if name == "pytesseract":
+        return PytesseractBackend(lang)
+    raise ValueError(f"Backend OCR inconnu: {name}")
+
+
+def word_overlap(reference, candidate):
+    """F1 sur les mots reconnus, 1.0 quand les deux backends lisent exactement les mêmes mots"""
+    reference_words = Counter(word['text'] for word in reference)
+    candidate_words = Counter(word['text'] for word in candidate)
+    common = sum((reference_words & candidate_words).values())
+    if not common:
+        return 0.0
+    precision = common / sum(candidate_words.values())
+    recall = common / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def compare_ocr_backends(images, backends=OCR_BACKENDS, lang="fra"):
+    """Passer les mêmes pages dans chaque backend et comparer la latence par page et les mots reconnus
+
+    Le premier backend disponible sert de référence pour les mots reconnus.
+    """
+    reports = []
+    reference = None
+
+    for name in backends:
+        start = time.perf_counter()
+        try:
+            backend = load_ocr_backend(name, lang)
+        except RuntimeError as e:
+            logging.warning(f"Backend {name} ignoré: {str(e)}")
+            continue
+        init_time = time.perf_counter() - start
+
+        results, latencies = [], []
+        for image in images:
+            start = time.perf_counter()
+            results.append(backend.image_to_words(image))
+            latencies.append(time.perf_counter() - start)
+        backend.close()
+
+        if reference is None:
+            reference = results
+        overlaps = [word_overlap(ref, words) for ref, words in zip(reference, results)]
+        reports.append({
+            'backend': name,
+            'init_time_ms': round(init_time * 1000, 1),
+            'mean_page_ms': round(sum(latencies) / len(latencies) * 1000, 1),
+            'max_page_ms': round(max(latencies) * 1000, 1),
+            'words': sum(len(words) for words in results),
+            'overlap_with_reference': round(sum(overlaps) / len(overlaps), 3),
+        })
+    return reports
+
+
+if __name__ == "__main__":
+    from pdf2image import convert_from_path
+
+    parser = argparse.ArgumentParser(description="Comparer la latence OCR par page des backends.")
+    parser.add_argument("pdf", help="PDF scanné utilisé pour la comparaison")
+    parser.add_argument("--pages", type=int, default=5, help="Nombre de pages à comparer")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--lang", default="fra")
+    parser.add_argument("--backends", nargs="+", default=list(OCR_BACKENDS), choices=OCR_BACKENDS)
+    args = parser.parse_args()
+
+    images = convert_from_path(args.pdf, dpi=args.dpi, first_page=1, last_page=args.pages)
+    reports = compare_ocr_backends(images, args.backends, args.lang)
+
+    print(f"{'backend':<12} {'init (ms)':>10} {'page (ms)':>10} {'max (ms)':>9} {'mots':>6} {'overlap':>8}")
+    for report in reports:
+        print(
+            f"{report['backend']:<12} {report['init_time_ms']:>10} {report['mean_page_ms']:>10} "
+            f"{report['max_page_ms']:>9} {report['words']:>6} {report['overlap_with_reference']:>8}"
+        )
@@ -1,18 +1,78 @@
 from pdf2image import convert_from_path
-import pytesseract
 from PIL import Image, ImageFilter
 import spacy
 import re
+import atexit
+import io
+import os
 import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 import time
 from tqdm import tqdm
 import fitz  # PyMuPDF
-import tempfile  # Pour stocker temporairement les images
+
+from ocr_backends import load_ocr_backend
+
+# Détection de la couche texte: une page dont les images couvrent au moins SCAN_IMAGE_COVERAGE de la surface
+# et dont les mots en couvrent moins de MIN_TEXT_COVERAGE est traitée comme un scan (OCR + floutage)
+SCAN_IMAGE_COVERAGE = 0.6
+MIN_TEXT_COVERAGE = 0.02
+
+
+def classify_page(page):
+    """Choisir le traitement d'une page: 'text' si sa couche texte est exploitable, 'scan' sinon"""
+    words = page.get_text("words")
+    if not words:
+        return "scan"
+    page_area = abs(page.rect)
+    text_coverage = sum(abs(fitz.Rect(word[:4])) for word in words) / page_area
+    image_coverage = min(1.0, sum(abs(fitz.Rect(image["bbox"]) & page.rect) for image in page.get_image_info()) / page_area)
+    if image_coverage >= SCAN_IMAGE_COVERAGE and text_coverage < MIN_TEXT_COVERAGE:
+        return "scan"
+    return "text"
+
+
+# Processeur propre à chaque processus du pool, avec son modèle spaCy chargé une seule fois
+_worker_processor = None
+
+
+def redact_page(page, rects):
+    """Caviarder en place les rectangles donnés sur une page du document"""
+    for rect in rects:
+        page.add_redact_annot(fitz.Rect(rect), fill=(0, 0, 0))
+    if rects:
+        page.apply_redactions()
+
+
+def _init_worker(ocr_backend):
+    global _worker_processor
+    _worker_processor = DocumentProcessor(ocr_backend=ocr_backend)
+    # Le moteur OCR (tesserocr) est libéré à l'arrêt du processus
+    atexit.register(_worker_processor.close)
+
+
+def _process_pages(pdf_path, first_page, last_page, dpi):
+    """Rendre et anonymiser une plage de pages dans un processus du pool"""
+    return _worker_processor.process_pages(pdf_path, first_page, last_page, dpi)
+
 
 class DocumentProcessor:
 
-    def __init__(self):
+    def __init__(self, workers=None, pages_per_task=2, max_in_flight_pages=None, dpi=200, ocr_backend=None):
+        # Pages rendues et traitées par tâche, et nombre maximal de pages en cours (donc en mémoire)
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.max_in_flight_pages = max_in_flight_pages or 2 * self.workers * pages_per_task
+        self.dpi = dpi
+        self._pool = None
+        # Moteur OCR créé à la première page scannée, puis gardé ouvert pour toutes celles de ce processus:
+        # avec un pool, le processus principal n'en charge aucun
+        self.ocr_backend = ocr_backend
+        self._ocr = None
+
         try:
             self.nlp = spacy.load("fr_core_news_md")
         except OSError:
@@ -36,24 +96,17 @@ class DocumentProcessor:
             'address': (r'\b\d+\s+(?:rue|avenue|boulevard|route|impasse|allée)\s+[A-Za-zéèêëàâäôöûüç\s-]+\b', '[ADRESSE]'),
         }
 
+    @property
+    def ocr(self):
+        # Créé à la demande, et recréé si le processeur est réutilisé après close()
+        if self._ocr is None:
+            self._ocr = load_ocr_backend(self.ocr_backend)
+        return self._ocr
+
     def extract_words_with_coordinates(self, image):
         """Extraire les mots et leurs coordonnées dans l'image"""
         try:
-            custom_config = r'--oem 3 --psm 6 -l fra'
-            data = pytesseract.image_to_data(image, config=custom_config, output_type=pytesseract.Output.DICT)
-
-            words = []
-            for i in range(len(data['text'])):
-                word = data['text'][i].strip()
-                if word:
-                    words.append({
-                        'text': word,
-                        'left': data['left'][i],
-                        'top': data['top'][i],
-                        'width': data['width'][i],
-                        'height': data['height'][i]
-                    })
-            return words
+            return self.ocr.image_to_words(image)
         except Exception as e:
             logging.error(f"Erreur lors de l'extraction des mots et des coordonnées: {str(e)}")
             return None
@@ -97,51 +150,154 @@ class DocumentProcessor:
             logging.error(f"Erreur lors du floutage des zones sensibles: {str(e)}")
             return None
 
+    def find_text_redactions(self, page):
+        """Repérer les mots sensibles d'une page à partir de sa couche texte
+
+        Renvoie les rectangles (x0, y0, x1, y1) à caviarder, appliqués ensuite sur l'original par redact_page.
+        """
+        words = [
+            {'text': text, 'left': x0, 'top': y0, 'width': x1 - x0, 'height': y1 - y0}
+            for x0, y0, x1, y1, text, *_ in page.get_text("words")
+        ]
+        words = self.label_sensitive_words(words)
+        return [
+            (word['left'], word['top'], word['left'] + word['width'], word['top'] + word['height'])
+            for word in words if word.get('sensitive', False)
+        ]
+
+    def process_scanned_page(self, pdf_path, page_number, dpi):
+        """Rendre une page (numérotée à partir de 0), la passer à l'OCR et flouter les zones sensibles
+
+        Renvoie l'image anonymisée encodée en PNG avec ses dimensions, ou None si aucun mot n'a été reconnu.
+        """
+        image = convert_from_path(pdf_path, dpi=dpi, first_page=page_number + 1, last_page=page_number + 1)[0]
+        words = self.extract_words_with_coordinates(image)
+        if not words:
+            return None
+
+        words = self.label_sensitive_words(words)
+        anonymized_image = self.blur_sensitive_areas(image, words)
+
+        # Encodage en mémoire, pour renvoyer l'image au processus principal sans fichier temporaire
+        buffer = io.BytesIO()
+        anonymized_image.save(buffer, format="PNG")
+        return buffer.getvalue(), image.width, image.height
+
+    def process_pages(self, pdf_path, first_page, last_page, dpi):
+        """Anonymiser les pages first_page à last_page (numérotées à partir de 1)
+
+        Chaque page prend le chemin vectoriel si sa couche texte est exploitable, le chemin
+        rendu + OCR + floutage sinon. Renvoie, pour chaque page, ('text', rectangles à caviarder),
+        ('scan', (PNG, largeur, hauteur)) ou ('scan', None) si l'OCR n'a reconnu aucun mot.
+        """
+        pages = []
+        with fitz.open(pdf_path) as document:
+            for page_number in range(first_page - 1, last_page):
+                page = document[page_number]
+                if classify_page(page) == "text":
+                    pages.append(("text", self.find_text_redactions(page)))
+                else:
+                    pages.append(("scan", self.process_scanned_page(pdf_path, page_number, dpi)))
+        return pages
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Spawned plutôt que forked, chaque processus charge son propre modèle spaCy
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(self.ocr_backend,))
+        return self._pool
+
+    def close(self):
+        """Libérer le moteur OCR et le pool; le processeur reste utilisable et les recrée au besoin"""
+        if self._ocr is not None:
+            self._ocr.close()
+            self._ocr = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
     def process_document(self, pdf_path, output_pdf_path):
-        """Traiter un document complet avec une barre de progression"""
+        """Traiter un document complet avec une barre de progression
+
+        Les pages sont rendues par plages de `pages_per_task` dans les processus du pool, au plus
+        `max_in_flight_pages` à la fois, et ajoutées au PDF dans l'ordre dès que leur plage est prête.
+        Les pages à couche texte sont caviardées sur l'original puis copiées par suites de pages
+        consécutives, leurs polices et ressources ne sont ainsi copiées qu'une fois.
+        """
         start_time = time.time()
 
         if not Path(pdf_path).exists():
             logging.error(f"Le fichier {pdf_path} n'existe pas.")
             return None
 
-        with tqdm(total=100, desc="📄 Traitement en cours", bar_format="{l_bar}{bar} {n_fmt}/{total_fmt} {postfix}") as progress_bar:
-            images = convert_from_path(pdf_path)
-            progress_bar.update(20)
+        with fitz.open(pdf_path) as source:
+            page_count = source.page_count
+            ranges = [
+                (first, min(first + self.pages_per_task - 1, page_count))
+                for first in range(1, page_count + 1, self.pages_per_task)
+            ]
+            max_in_flight = max(1, self.max_in_flight_pages // self.pages_per_task)
 
-            pdf_document = fitz.open()
+            def submit(first, last):
+                if self.workers == 1:
+                    future = Future()
+                    future.set_result(self.process_pages(pdf_path, first, last, self.dpi))
+                    return future
+                return self._get_pool().submit(_process_pages, pdf_path, first, last, self.dpi)
 
-            for image in images:
-                words = self.extract_words_with_coordinates(image)
-                if not words:
-                    continue
-                progress_bar.update(10)
+            path_counts = {'text': 0, 'scan': 0, 'skipped': 0}
+            with tqdm(total=page_count, desc="📄 Traitement en cours", unit="page") as progress_bar:
+                pdf_document = fitz.open()
+                pending = deque()
+                next_range = 0
+                # Première page de la suite de pages texte caviardées pas encore copiée
+                text_run_start = None
 
-                words = self.label_sensitive_words(words)
-                progress_bar.update(20)
+                while next_range < len(ranges) or pending:
+                    while next_range < len(ranges) and len(pending) < max_in_flight:
+                        first, last = ranges[next_range]
+                        pending.append((first, submit(first, last)))
+                        next_range += 1
 
-                anonymized_image = self.blur_sensitive_areas(image, words)
-                progress_bar.update(20)
+                    # La plage la plus ancienne est attendue en premier: l'ordre des pages est conservé
+                    first, future = pending.popleft()
+                    for page_number, (path, *page) in enumerate(future.result(), start=first - 1):
+                        progress_bar.update(1)
+                        if path == "text":
+                            # Page caviardée sur l'original, copiée avec les pages texte qui la suivent
+                            path_counts['text'] += 1
+                            redact_page(source[page_number], page[0])
+                            if text_run_start is None:
+                                text_run_start = page_number
+                            continue
+                        if text_run_start is not None:
+                            pdf_document.insert_pdf(source, from_page=text_run_start, to_page=page_number - 1)
+                            text_run_start = None
+                        if page[0] is None:
+                            path_counts['skipped'] += 1
+                            continue
+                        path_counts['scan'] += 1
+                        png, width, height = page[0]
+                        # Ajout de l'image anonymisée au PDF
+                        pdf_page = pdf_document.new_page(width=width, height=height)
+                        pdf_page.insert_image(fitz.Rect(0, 0, width, height), stream=png)
 
-                # Sauvegarde temporaire de l'image
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as temp_img:
-                    anonymized_image.save(temp_img.name)
-                    temp_img_path = temp_img.name
-
-                # Ajout de l'image anonymisée au PDF
-                pdf_page = pdf_document.new_page(width=image.width, height=image.height)
-                pdf_page.insert_image(fitz.Rect(0, 0, image.width, image.height), filename=temp_img_path)
-
-            pdf_document.save(output_pdf_path)
-            pdf_document.close()
-            progress_bar.update(30)
+                if text_run_start is not None:
+                    pdf_document.insert_pdf(source, from_page=text_run_start, to_page=page_count - 1)
+                # Objets inutilisés ou en double supprimés, flux compressés
+                pdf_document.save(output_pdf_path, garbage=4, deflate=True)
+                pdf_document.close()
 
         end_time = time.time()
         execution_time = round(end_time - start_time, 4)
 
+        logging.info(f"Pages: {path_counts['text']} par la couche texte, {path_counts['scan']} par OCR, "
+                     f"{path_counts['skipped']} sans texte reconnu")
+
         return {
             'output_pdf_path': output_pdf_path,
-            'execution_time': execution_time
+            'execution_time': execution_time,
+            'pages': path_counts
         }
 
 # Exemple d'utilisation
@@ -154,7 +310,10 @@ if __name__ == "__main__":
 
     print("\n📌 **Début du traitement du document**")
     results = processor.process_document(pdf_path, output_pdf_path)
+    processor.close()
 
     if results:
         print(f"\n✅ **Document anonymisé sauvegardé sous** : {results['output_pdf_path']}")
         print(f"⏳ **Temps d'exécution** : {results['execution_time']} sec")
+        print(f"📊 **Pages** : {results['pages']['text']} couche texte, {results['pages']['scan']} OCR, "
+              f"{results['pages']['skipped']} sans texte")
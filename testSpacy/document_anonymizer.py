@@ -1,8 +1,13 @@
 import spacy
 import re
-from typing import List, Dict, Tuple, Set
-from dataclasses import dataclass
+import bisect
+from collections import OrderedDict, deque
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Tuple, Set
+from dataclasses import dataclass, field
 import logging
+from spacy.util import raise_error
+
+from ner_cache import NERCache, iter_paragraphs, normalize_paragraph
 
 @dataclass
 class SensitivePattern:
@@ -11,10 +16,82 @@ class SensitivePattern:
     replacement: str
     priority: int
 
+def _skip_failed_document(proc_name, proc, docs, e):
+    """Gestionnaire d'erreurs de nlp.pipe: le document en échec est écarté au lieu d'interrompre le lot."""
+    logging.error(f"Erreur du composant {proc_name} sur {len(docs)} document(s): {str(e)}")
+
+@dataclass(frozen=True)
+class Span:
+    """Portion du texte à remplacer, issue d'une entité nommée ou d'un pattern."""
+    start: int
+    end: int
+    priority: int
+    name: str
+    replacement: str
+    source: str  # 'entity' ou 'pattern'
+
+@dataclass
+class _PendingText:
+    """Texte en cours d'anonymisation, dont la NER est faite passage par passage."""
+    text: Any
+    # (début dans le texte, position d'origine de chaque caractère normalisé ou None, clé de cache ou None)
+    pieces: List[Tuple[int, Optional[List[int]], Optional[str]]] = field(default_factory=list)
+    entities: List[Optional[list]] = field(default_factory=list)  # None tant que la NER n'est pas faite
+    expected: deque = field(default_factory=deque)  # Passages envoyés à spaCy, dans l'ordre
+    error: Optional[str] = None
+
+# Fin de phrase ou de paragraphe, où couper les fenêtres du mode flux
+SENTENCE_END = re.compile(r"[.!?…]\s+|\n\s*\n")
+
+class _KnownEntities:
+    """Textes d'entités nommées (texte -> label) recherchés partout dans le texte, avec leur expression compilée.
+
+    L'expression n'est recompilée que lorsque l'ensemble des textes change. Avec `max_entries`, seules les
+    entités vues le plus récemment sont gardées (LRU), ce qui borne la mémoire et le coût par fenêtre du mode flux.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries
+        self.labels: OrderedDict = OrderedDict()
+        self._occurrences: Optional[re.Pattern] = None
+
+    def add(self, text: str, label: str):
+        if text in self.labels:
+            self.labels.move_to_end(text)
+            return
+        self.labels[text] = label
+        self._occurrences = None
+        if self.max_entries is not None and len(self.labels) > self.max_entries:
+            self.labels.popitem(last=False)
+
+    def touch(self, text: str) -> str:
+        self.labels.move_to_end(text)
+        return self.labels[text]
+
+    def occurrences(self) -> Optional[re.Pattern]:
+        # Un seul parcours pour toutes les occurrences, les textes les plus longs d'abord
+        if self._occurrences is None and self.labels:
+            self._occurrences = re.compile("|".join(re.escape(t) for t in sorted(self.labels, key=len, reverse=True)))
+        return self._occurrences
+
 class DocumentAnonymizer:
-    def __init__(self, model_name: str = "fr_core_news_md"):
+    # Mapping des types d'entités
+    ENTITY_REPLACEMENTS = {
+        'PER': '[PERSONNE]',
+        'ORG': '[ORGANISATION]',
+        'LOC': '[LIEU]',
+        'GPE': '[LIEU]'
+    }
+    # Les entités nommées passent après les patterns de priorité 1 (téléphone, email...)
+    ENTITY_PRIORITY = 2
+
+    def __init__(self, model_name: str = "fr_core_news_md", ner_cache: Optional[NERCache] = None):
         self.nlp = spacy.load(model_name)
+        # Avec un cache, la NER est faite par paragraphe et réutilisée d'un document à l'autre
+        self.ner_cache = ner_cache
+        self.model_version = f"{self.nlp.meta.get('lang')}_{self.nlp.meta.get('name')}-{self.nlp.meta.get('version')}:{','.join(self.nlp.pipe_names)}"
         self.patterns = self._initialize_patterns()
+        self._matchers = None
         self.seen_entities: Dict[str, Set[str]] = {}
         logging.basicConfig(level=logging.INFO)
         
@@ -65,101 +142,324 @@ class DocumentAnonymizer:
             )
         ]
 
+    def _get_matchers(self) -> List[Tuple[re.Pattern, SensitivePattern]]:
+        """Compile une seule fois chaque pattern, dans l'ordre de priorité.
+
+        Chaque pattern est cherché séparément: une correspondance d'un pattern moins prioritaire qui commence plus
+        tôt ne peut pas masquer celle d'un pattern plus prioritaire, les chevauchements étant résolus par
+        `_merge_spans`.
+        """
+        if self._matchers is None:
+            self._matchers = [
+                (re.compile(pattern.pattern, re.IGNORECASE), pattern)
+                for pattern in sorted(self.patterns, key=lambda x: x.priority)
+            ]
+        return self._matchers
+
+    def _prepare(self, text: str) -> Tuple[_PendingText, List[Tuple[int, str]]]:
+        """Découpe un texte en passages pour la NER; renvoie aussi les passages (indice, texte) absents du cache."""
+        if self.ner_cache is None:
+            return _PendingText(text, pieces=[(0, None, None)], entities=[None]), [(0, text)]
+
+        record, to_run = _PendingText(text), []
+        for start, paragraph in iter_paragraphs(text):
+            normalized, offsets = normalize_paragraph(paragraph)
+            key = NERCache.key(normalized, self.model_version)
+            cached = self.ner_cache.get(key)
+            record.pieces.append((start, offsets, key))
+            record.entities.append(cached)
+            if cached is None:
+                to_run.append((len(record.pieces) - 1, normalized))
+        return record, to_run
+
+    def _store(self, record: _PendingText, slot: int, doc):
+        entities = [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+        record.entities[slot] = entities
+        key = record.pieces[slot][2]
+        if key is not None:
+            self.ner_cache.put(key, entities)
+
+    @staticmethod
+    def _collect(record: _PendingText) -> List[Tuple[int, int, str]]:
+        """Replace les entités de chaque passage à leur position dans le texte d'origine."""
+        entities = []
+        for (start, offsets, _), piece_entities in zip(record.pieces, record.entities):
+            for s, e, label in piece_entities:
+                if offsets is None:
+                    entities.append((start + s, start + e, label))
+                else:
+                    entities.append((start + offsets[s], start + offsets[e - 1] + 1, label))
+        return entities
+
+    def _ner_entities(self, text: str) -> List[Tuple[int, int, str]]:
+        """Entités nommées (début, fin, label) du texte, la NER ne portant que sur les passages absents du cache."""
+        record, to_run = self._prepare(text)
+        for slot, piece in to_run:
+            self._store(record, slot, self.nlp(piece))
+        return self._collect(record)
+
+    def _entity_spans(self, text: str, entities: List[Tuple[int, int, str]],
+                      known: Optional[_KnownEntities] = None) -> List[Span]:
+        """Repère les entités nommées du texte, ainsi que toutes les autres occurrences de leur texte.
+
+        `known` conserve les entités d'une fenêtre à l'autre en mode flux.
+        """
+        known = known if known is not None else _KnownEntities()
+        for start, end, label in entities:
+            if label in self.ENTITY_REPLACEMENTS:
+                known.add(text[start:end], label)
+        occurrences = known.occurrences()
+        if occurrences is None:
+            return []
+
+        spans = []
+        for match in occurrences.finditer(text):
+            label = known.touch(match.group(0))
+            spans.append(Span(match.start(), match.end(), self.ENTITY_PRIORITY, label,
+                              self.ENTITY_REPLACEMENTS[label], 'entity'))
+        return spans
+
+    def _pattern_spans(self, text: str) -> List[Span]:
+        """Repère les correspondances de chaque pattern régulier, chevauchements compris."""
+        return [
+            Span(match.start(), match.end(), pattern.priority, pattern.name, pattern.replacement, 'pattern')
+            for regex, pattern in self._get_matchers()
+            for match in regex.finditer(text)
+        ]
+
+    @staticmethod
+    def _merge_spans(spans: List[Span]) -> List[Span]:
+        """Résout les chevauchements: priorité d'abord, puis la portion la plus longue, puis la première.
+
+        Une portion moins prioritaire qui englobe entièrement des portions déjà retenues, plus courtes, les
+        remplace: une adresse dont la ligne contient un numéro de téléphone est remplacée en entier, comme
+        lorsque les patterns étaient appliqués l'un après l'autre. Un chevauchement partiel l'écarte.
+        """
+        taken = []  # Portions retenues (début, fin, portion), triées par début et sans chevauchement
+        for span in sorted(spans, key=lambda s: (s.priority, s.start - s.end, s.start)):
+            i = bisect.bisect_left(taken, (span.start,))
+            first = i - 1 if i > 0 and taken[i - 1][1] > span.start else i
+            last = i
+            while last < len(taken) and taken[last][0] < span.end:
+                last += 1
+            if any(
+                start < span.start or end > span.end or (start, end) == (span.start, span.end)
+                for start, end, _ in taken[first:last]
+            ):
+                continue
+            taken[first:last] = [(span.start, span.end, span)]
+        return [span for _, _, span in taken]
+
+    @staticmethod
+    def _apply_spans(text: str, spans: List[Span]) -> Tuple[str, Dict[str, Set[str]]]:
+        """Construit le texte anonymisé en une seule jointure, à partir de portions sans chevauchement."""
+        parts = []
+        found = {}
+        position = 0
+        for span in spans:
+            parts.append(text[position:span.start])
+            parts.append(span.replacement)
+            found.setdefault(span.name, set()).add(text[span.start:span.end])
+            position = span.end
+        parts.append(text[position:])
+        return "".join(parts), found
+
     def _anonymize_entities(self, text: str) -> Tuple[str, Dict[str, Set[str]]]:
         """Anonymise les entités nommées dans le texte."""
-        doc = self.nlp(text)
-        anonymized = text
-        entities_found = {}
-
-        # Mapping des types d'entités
-        entity_replacements = {
-            'PER': '[PERSONNE]',
-            'ORG': '[ORGANISATION]',
-            'LOC': '[LIEU]',
-            'GPE': '[LIEU]'
-        }
-
-        # Trier les entités par longueur (plus longues d'abord)
-        entities = sorted(doc.ents, key=lambda x: len(x.text), reverse=True)
-        
-        for ent in entities:
-            if ent.label_ in entity_replacements:
-                replacement = entity_replacements[ent.label_]
-                
-                # Sauvegarder l'entité trouvée
-                if ent.label_ not in entities_found:
-                    entities_found[ent.label_] = set()
-                entities_found[ent.label_].add(ent.text)
-                
-                # Remplacer toutes les occurrences
-                anonymized = anonymized.replace(ent.text, replacement)
-
-        return anonymized, entities_found
+        return self._apply_spans(text, self._merge_spans(self._entity_spans(text, self._ner_entities(text))))
 
     def _anonymize_patterns(self, text: str) -> Tuple[str, Dict[str, Set[str]]]:
         """Anonymise les patterns réguliers dans le texte."""
-        anonymized = text
-        patterns_found = {}
+        return self._apply_spans(text, self._merge_spans(self._pattern_spans(text)))
 
-        # Trier les patterns par priorité
-        sorted_patterns = sorted(self.patterns, key=lambda x: x.priority)
-        
-        for pattern in sorted_patterns:
-            matches = re.finditer(pattern.pattern, anonymized, re.IGNORECASE)
-            
-            # Sauvegarder et remplacer chaque match
-            for match in matches:
-                if pattern.name not in patterns_found:
-                    patterns_found[pattern.name] = set()
-                patterns_found[pattern.name].add(match.group(0))
-                
-                anonymized = anonymized.replace(match.group(0), pattern.replacement)
-
-        return anonymized, patterns_found
+    def _build_result(self, text: str, entities: List[Tuple[int, int, str]], keep_statistics: bool) -> Dict[str, any]:
+        """Anonymise un texte dont les entités nommées sont déjà connues."""
+        # Entités nommées et patterns réguliers sont repérés sur le texte d'origine puis résolus ensemble
+        spans = self._merge_spans(self._entity_spans(text, entities) + self._pattern_spans(text))
+        anonymized, _ = self._apply_spans(text, spans)
+        entities, patterns = {}, {}
+        for span in spans:
+            found = entities if span.source == 'entity' else patterns
+            found.setdefault(span.name, set()).add(text[span.start:span.end])
+
+        result = {
+            'success': True,
+            'anonymized_text': anonymized,
+        }
+
+        if keep_statistics:
+            result.update({
+                'statistics': {
+                    'original_length': len(text),
+                    'anonymized_length': len(anonymized),
+                    'entities_found': {k: len(v) for k, v in entities.items()},
+                    'patterns_found': {k: len(v) for k, v in patterns.items()}
+                }
+            })
+
+        return result
+
+    @staticmethod
+    def _error_result(text, error: str) -> Dict[str, any]:
+        logging.error(f"Erreur lors de l'anonymisation: {error}")
+        return {
+            'success': False,
+            'error': error,
+            'anonymized_text': text  # Retourne le texte original en cas d'erreur
+        }
 
     def anonymize(self, text: str, keep_statistics: bool = True) -> Dict[str, any]:
         """
         Anonymise le texte en utilisant à la fois les entités nommées et les patterns.
         """
         try:
-            # Première passe : entités nommées
-            anonymized, entities = self._anonymize_entities(text)
-            
-            # Deuxième passe : patterns réguliers
-            anonymized, patterns = self._anonymize_patterns(anonymized)
-            
-            result = {
-                'success': True,
-                'anonymized_text': anonymized,
-            }
-
-            if keep_statistics:
-                result.update({
-                    'statistics': {
-                        'original_length': len(text),
-                        'anonymized_length': len(anonymized),
-                        'entities_found': {k: len(v) for k, v in entities.items()},
-                        'patterns_found': {k: len(v) for k, v in patterns.items()}
-                    }
-                })
-
-            return result
-
+            return self._build_result(text, self._ner_entities(text), keep_statistics)
         except Exception as e:
-            logging.error(f"Erreur lors de l'anonymisation: {str(e)}")
-            return {
-                'success': False,
-                'error': str(e),
-                'anonymized_text': text  # Retourne le texte original en cas d'erreur
-            }
+            return self._error_result(text, str(e))
+
+    def anonymize_many(self, texts: Iterable[str], batch_size: int = 64, n_process: int = 1,
+                       keep_statistics: bool = True) -> Iterator[Dict[str, any]]:
+        """
+        Anonymise un flux de textes via nlp.pipe, par lots de `batch_size` et sur `n_process` processus.
+
+        Les résultats sont produits au fil de l'eau, dans l'ordre des textes, avec la même structure que
+        `anonymize`. Un document en échec donne un résultat `success: False` sans interrompre les autres.
+        Le pipeline ignore les erreurs de ses composants tant que le générateur est consommé.
+        Avec un cache de NER, seuls les paragraphes absents du cache passent par spaCy.
+        """
+        pending = OrderedDict()  # Textes en cours, par indice, dans l'ordre d'arrivée
+
+        def to_ner():
+            for index, text in enumerate(texts):
+                # Écartés avant spaCy, qui interromprait tout le lot
+                if not isinstance(text, str):
+                    record, to_run = _PendingText(text, error=f"Texte attendu, reçu {type(text).__name__}"), []
+                elif len(text) > self.nlp.max_length:
+                    record, to_run = _PendingText(text, error=f"Texte trop long ({len(text)} caractères, maximum {self.nlp.max_length})"), []
+                else:
+                    record, to_run = self._prepare(text)
+                pending[index] = record
+                for slot, piece in to_run:
+                    record.expected.append(slot)
+                    yield piece, (index, slot)
+                # Marqueur de fin (document vide): un texte entièrement en cache est restitué à son tour sans attendre
+                yield "", (index, None)
+
+        def finish(record):
+            # Un passage écarté par le gestionnaire d'erreurs n'est jamais revenu
+            if record.error is None and record.expected:
+                record.error = "Échec du pipeline spaCy"
+            if record.error is not None:
+                return self._error_result(record.text, record.error)
+            try:
+                return self._build_result(record.text, self._collect(record), keep_statistics)
+            except Exception as e:
+                return self._error_result(record.text, str(e))
+
+        self.nlp.set_error_handler(_skip_failed_document)
+        try:
+            for doc, (index, slot) in self.nlp.pipe(to_ner(), as_tuples=True, batch_size=batch_size, n_process=n_process):
+                # Les résultats suivent l'ordre des entrées: les textes précédents sont terminés
+                while next(iter(pending)) != index:
+                    yield finish(pending.popitem(last=False)[1])
+                record = pending[index]
+                if slot is None:
+                    yield finish(pending.popitem(last=False)[1])
+                    continue
+                while record.expected[0] != slot:
+                    record.expected.popleft()
+                    record.error = "Échec du pipeline spaCy"
+                record.expected.popleft()
+                self._store(record, slot, doc)
+            while pending:
+                yield finish(pending.popitem(last=False)[1])
+        finally:
+            self.nlp.set_error_handler(raise_error)
+
+    @staticmethod
+    def _sentence_cut(text: str, limit: int) -> int:
+        """Position de coupe au plus tard à `limit`: fin de phrase, à défaut espace, à défaut `limit`."""
+        last = None
+        for last in SENTENCE_END.finditer(text, limit // 2, limit):
+            pass
+        if last is not None:
+            return last.end()
+        space = text.rfind(" ", limit // 2, limit)
+        return space + 1 if space != -1 else limit
+
+    def anonymize_stream(self, chunks: Iterable[str], window_chars: int = 50000,
+                         overlap_chars: int = 1000, max_known_entities: int = 5000) -> Iterator[str]:
+        """
+        Anonymise un texte lu au fil de l'eau (pages, lignes, fichier ouvert...), fenêtre par fenêtre.
+
+        Les fenêtres d'environ `window_chars` caractères sont coupées en fin de phrase. Chacune est analysée
+        avec `overlap_chars` caractères du texte qui la précède (contexte de la NER) et qui la suit, pour
+        ne pas manquer une entité à cheval sur la coupe; une telle entité est remplacée en entier et la
+        fenêtre suivante commence après elle. Le texte anonymisé est produit fenêtre par fenêtre: la
+        mémoire dépend de la taille des fenêtres et non de celle du document.
+
+        Les entités déjà vues sont aussi remplacées dans les fenêtres suivantes; seules les
+        `max_known_entities` vues le plus récemment sont retenues.
+        """
+        if window_chars + 2 * overlap_chars > self.nlp.max_length:
+            raise ValueError(f"Fenêtre trop grande pour le modèle (maximum {self.nlp.max_length} caractères)")
+
+        chunks = iter(chunks)
+        known = _KnownEntities(max_known_entities)
+        context = ""
+        buffer = ""
+        exhausted = False
+
+        while True:
+            parts = [buffer]
+            size = len(buffer)
+            while not exhausted and size < window_chars + overlap_chars:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    parts.append(chunk)
+                    size += len(chunk)
+            buffer = "".join(parts)
+            if not buffer:
+                return
+
+            final = exhausted and len(buffer) <= window_chars + overlap_chars
+            cut = len(buffer) if final else self._sentence_cut(buffer, window_chars)
+            window = context + buffer[:cut + overlap_chars]
+            offset = len(context)
+
+            # Seules les portions qui commencent dans le nouveau texte sont retenues, celles du contexte l'ont déjà été
+            spans = [
+                span for span in self._entity_spans(window, self._ner_entities(window), known) + self._pattern_spans(window)
+                if span.start >= offset
+            ]
+            spans = [span for span in self._merge_spans(spans) if span.start < offset + cut]
+            end = max([offset + cut] + [span.end for span in spans])
+
+            anonymized, _ = self._apply_spans(window[offset:end], [
+                Span(span.start - offset, span.end - offset, span.priority, span.name, span.replacement, span.source)
+                for span in spans
+            ])
+            yield anonymized
+
+            consumed = end - offset
+            context = buffer[max(0, consumed - overlap_chars):consumed]
+            buffer = buffer[consumed:]
 
     def add_custom_pattern(self, name: str, pattern: str, replacement: str, priority: int = 1):
-        """Ajoute un nouveau pattern personnalisé."""
+        """Ajoute un nouveau pattern personnalisé.
+
+        Le pattern est compilé tout de suite: une expression invalide lève re.error à l'ajout.
+        """
+        re.compile(pattern, re.IGNORECASE)
         self.patterns.append(SensitivePattern(
             name=name,
             pattern=pattern,
             replacement=replacement,
             priority=priority
         ))
+        # Les patterns seront recompilés avec le nouveau
+        self._matchers = None
 
     
\ No newline at end of file
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+WORD = re.compile(r"\S+")
+
+# Entité sous la forme (début, fin, label), relative au paragraphe normalisé
+Entity = Tuple[int, int, str]
+
+
+def iter_paragraphs(text: str) -> Iterator[Tuple[int, str]]:
+    """Parcourt les paragraphes non vides d'un texte, avec leur position de début."""
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        if text[start:match.start()].strip():
+            yield start, text[start:match.start()]
+        start = match.end()
+    if text[start:].strip():
+        yield start, text[start:]
+
+
+def normalize_paragraph(paragraph: str) -> Tuple[str, List[int]]:
+    """Normalise les espaces d'un paragraphe.
+
+    Renvoie le texte normalisé et, pour chacun de ses caractères, sa position dans le paragraphe d'origine,
+    afin de replacer les entités trouvées sur le texte normalisé.
+    """
+    words, offsets = [], []
+    for match in WORD.finditer(paragraph):
+        if words:
+            offsets.append(match.start() - 1)  # L'espace qui sépare deux mots
+        words.append(match.group(0))
+        offsets.extend(range(match.start(), match.end()))
+    return " ".join(words), offsets
+
+
+class NERCache:
+    """
+    Cache des entités nommées par paragraphe, pour ne pas refaire la NER des passages récurrents
+    (clauses types, pieds de page de factures...).
+
+    Les entrées sont indexées par l'empreinte du paragraphe normalisé et la version du modèle. Le niveau
+    en mémoire est un LRU borné à `max_entries` paragraphes; le niveau SQLite optionnel (`db_path`)
+    survit aux redémarrages et alimente le niveau en mémoire.
+    """
+
+    def __init__(self, max_entries: int = 10000, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS ner_cache (key TEXT PRIMARY KEY, entities TEXT NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(normalized: str, model_version: str) -> str:
+        return hashlib.sha256(f"{model_version}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Entity]]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            entities = self._disk_get(key)
+            if entities is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_put(key, entities)
+            return entities
+
+    def put(self, key: str, entities: List[Entity]):
+        with self._lock:
+            self._memory_put(key, entities)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO ner_cache (key, entities) VALUES (?, ?)",
+                        (key, json.dumps(entities, ensure_ascii=False))
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.warning(f"Impossible d'écrire dans le cache {self.db_path}: {str(e)}")
+
+    def _memory_put(self, key: str, entities: List[Entity]):
+        self._memory[key] = entities
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[List[Entity]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT entities FROM ner_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Impossible de lire le cache {self.db_path}: {str(e)}")
+            return None
+        return [tuple(entity) for entity in json.loads(row[0])] if row else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._memory),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
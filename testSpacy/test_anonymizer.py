@@ -1,4 +1,5 @@
 from document_anonymizer import DocumentAnonymizer
+from ner_cache import NERCache
 
 def test_anonymizer():
     # Initialiser l'anonymiseur
@@ -80,5 +81,50 @@ def test_anonymizer():
     print("Original:", custom_text)
     print("Anonymisé:", result['anonymized_text'])
 
+    # Cas de test 6: Anonymisation par lots
+    print("\n=== Test 6: Anonymisation par lots ===")
+    batch = [entities, None, contacts, custom_text]
+    for text, result in zip(batch, anonymizer.anonymize_many(batch, batch_size=2)):
+        print("Original:", text)
+        print("Anonymisé:" if result['success'] else "Erreur:", result['anonymized_text'] if result['success'] else result['error'])
+
+    # Cas de test 7: Cache des entités par paragraphe
+    print("\n=== Test 7: Cache des entités ===")
+    cached_anonymizer = DocumentAnonymizer(ner_cache=NERCache(max_entries=1000))
+    footer = "Pierre Martin, gérant de la société, à Paris.\n\nTél: 06 12 34 56 78"
+    for i in range(3):
+        result = cached_anonymizer.anonymize(f"Facture n°{i}\n\n{footer}")
+        print("Anonymisé:", result['anonymized_text'])
+    print("Cache:", cached_anonymizer.ner_cache.stats())
+
+    # Cas de test 8: Anonymisation en flux
+    print("\n=== Test 8: Anonymisation en flux ===")
+    lines = (line + "\n" for line in (document * 20).splitlines())
+    for chunk in anonymizer.anonymize_stream(lines, window_chars=2000, overlap_chars=200):
+        print(f"Fenêtre de {len(chunk)} caractères:", chunk[:80].strip().replace("\n", " | "))
+
+def test_overlapping_patterns():
+    # Pipeline vide: seuls les patterns sont testés, sans modèle NER à installer
+    anonymizer = DocumentAnonymizer("blank:fr")
+    text = (
+        "Adresse: 12 rue de la Paix 75002 Paris, tél. 06 12 34 56 78\n"
+        "Né le 01/02/06 12 34 56 78\n"
+        "RDV le 03/04/2024 au 01 23 45 67 89\n"
+    )
+    result = anonymizer.anonymize(text)
+    assert result['success']
+    # L'adresse englobe le téléphone de sa ligne; une date qui empiète sur un téléphone est écartée
+    assert result['anonymized_text'] == (
+        "Adresse: [ADRESSE]"
+        "Né le 01/02/[TÉLÉPHONE]\n"
+        "RDV le [DATE] au [TÉLÉPHONE]\n"
+    )
+
+    # Un pattern personnalisé avec un drapeau global ne casse pas les autres patterns
+    anonymizer.add_custom_pattern(name="PROJET", pattern=r'(?x) PRJ - \d{4}', replacement="[PROJET]")
+    result = anonymizer.anonymize("Projet PRJ-2024, tél. 06 12 34 56 78")
+    assert result['anonymized_text'] == "Projet [PROJET], tél. [TÉLÉPHONE]"
+
 if __name__ == "__main__":
-    test_anonymizer()
\ No newline at end of file
+    test_anonymizer()
+    test_overlapping_patterns()
\ No newline at end of file
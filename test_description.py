@@ -0,0 +1,78 @@
+import os
+import threading
+
+from fastapi.testclient import TestClient
+
+# Limite lue à l'import du service: 100 KB suffisent pour tester le 413
+os.environ["MAX_UPLOAD_MB"] = "0.1"
+
+import description  # noqa: E402
+from worker_pool import WorkerPool  # noqa: E402
+
+PDF = b"%PDF-1.4\n" + b"x" * 1000
+OVERSIZED_PDF = b"%PDF-1.4\n" + b"x" * 500_000
+
+
+def post_pdf(client, data, **params):
+    return client.post("/summarize/", files={"file": ("document.pdf", data, "application/pdf")}, params=params)
+
+
+def record_uploads(monkeypatch):
+    """Remplace la lecture de l'upload par le handler: rien n'est enregistré si le middleware a répondu"""
+    uploads = []
+
+    async def read_pdf_upload(file):
+        uploads.append(file.filename)
+        raise AssertionError("le corps aurait dû être refusé avant le handler")
+
+    monkeypatch.setattr(description, "read_pdf_upload", read_pdf_upload)
+    return uploads
+
+
+def test_saturated_pool_answers_503(monkeypatch):
+    pool = WorkerPool(max_workers=1, max_queue=0)
+    blocker = threading.Event()
+    monkeypatch.setattr(description, "pool", pool)
+    monkeypatch.setattr(description, "run_task", lambda data, *args: "résumé")
+    try:
+        pool.submit(blocker.wait)
+        response = post_pdf(TestClient(description.app), PDF, use_cache="false")
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(description.RETRY_AFTER_S)
+    finally:
+        blocker.set()
+        pool.shutdown()
+
+
+def test_small_upload_is_processed(monkeypatch):
+    monkeypatch.setattr(description, "run_task", lambda data, *args: f"{len(data)} octets")
+    response = post_pdf(TestClient(description.app), PDF)
+    assert response.status_code == 200
+    assert response.json() == {"Summary": f"{len(PDF)} octets"}
+
+
+def test_declared_oversized_upload_answers_413(monkeypatch):
+    uploads = record_uploads(monkeypatch)
+    response = post_pdf(TestClient(description.app), OVERSIZED_PDF)
+    assert response.status_code == 413
+    assert not uploads
+
+
+def test_streamed_oversized_upload_is_cut_off(monkeypatch):
+    # Sans Content-Length: le corps est compté au fil de la réception
+    uploads = record_uploads(monkeypatch)
+    boundary = "limite"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"document.pdf\"\r\n"
+        f"Content-Type: application/pdf\r\n\r\n"
+    ).encode() + OVERSIZED_PDF + f"\r\n--{boundary}--\r\n".encode()
+
+    def chunks():
+        for start in range(0, len(body), 16 * 1024):
+            yield body[start:start + 16 * 1024]
+
+    response = TestClient(description.app).post(
+        "/summarize/", content=chunks(), headers={"content-type": f"multipart/form-data; boundary={boundary}"}
+    )
+    assert response.status_code == 413
+    assert not uploads
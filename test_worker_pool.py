@@ -0,0 +1,80 @@
+import gc
+import threading
+
+import pytest
+
+from worker_pool import PoolSaturated, WorkerPool
+
+
+def test_saturated_pool_rejects_then_recovers():
+    pool = WorkerPool(max_workers=1, max_queue=0)
+    blocker = threading.Event()
+    try:
+        running = pool.submit(blocker.wait)
+        with pytest.raises(PoolSaturated):
+            pool.submit(lambda: None)
+        assert pool.stats()["rejected"] == 1
+
+        blocker.set()
+        running.result(timeout=5)
+        assert pool.submit(lambda: "ok").result(timeout=5) == "ok"
+    finally:
+        blocker.set()
+        pool.shutdown()
+
+
+def test_reservation_takes_a_slot():
+    pool = WorkerPool(max_workers=1, max_queue=0)
+    try:
+        reservation = pool.reserve()
+        with pytest.raises(PoolSaturated):
+            pool.submit(lambda: None)
+
+        assert pool.submit(lambda: "ok", reservation=reservation).result(timeout=5) == "ok"
+        with pytest.raises(RuntimeError):
+            reservation.claim()
+        # Le slot est rendu par la fin de la tâche, pas une seconde fois par la réservation
+        reservation.release()
+        assert pool.stats()["admitted"] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_dropped_reservation_gives_its_slot_back():
+    pool = WorkerPool(max_workers=1, max_queue=0)
+    try:
+        reservation = pool.reserve()
+        assert pool.stats()["admitted"] == 1
+        del reservation
+        gc.collect()
+        assert pool.stats()["admitted"] == 0
+        pool.reserve().release()
+    finally:
+        pool.shutdown()
+
+
+def test_reservation_dropped_under_the_lock():
+    # Une réservation collectée pendant que le verrou est tenu le reprend pour rendre son slot
+    pool = WorkerPool(max_workers=1, max_queue=0)
+    reservation = [pool.reserve()]
+
+    def drop():
+        with pool._lock:
+            reservation.clear()
+
+    thread = threading.Thread(target=drop, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    try:
+        assert not thread.is_alive()
+        assert pool.stats()["admitted"] == 0
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    test_saturated_pool_rejects_then_recovers()
+    test_reservation_takes_a_slot()
+    test_dropped_reservation_gives_its_slot_back()
+    test_reservation_dropped_under_the_lock()
+    print("OK")
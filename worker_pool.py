@@ -0,0 +1,204 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised when every admission slot of a WorkerPool is taken."""
+
+
+class Reservation:
+    """An admission slot taken ahead of a submit, handed to `WorkerPool.submit` or released."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._held = True
+
+    def claim(self):
+        if not self._held:
+            raise RuntimeError("Reservation already used or released")
+        self._held = False
+
+    def release(self):
+        """Gives the slot back if it was not used. Safe to call more than once."""
+        if self._held:
+            self._held = False
+            self._pool._release()
+
+    def __del__(self):
+        # A reservation dropped without being used (e.g. a response never started) must not leak its slot.
+        self.release()
+
+
+class WorkerPool:
+    """
+    Runs blocking work off the event loop, behind a bounded admission queue.
+
+    At most `max_workers` tasks run at once and at most `max_queue` more wait for a worker.
+    Anything beyond that is rejected right away with PoolSaturated instead of piling up.
+
+    With kind="thread" the workers share the process, hence the resident models and the batching
+    scheduler. With kind="process" each worker is a separate interpreter with its own copy of the
+    models; tasks submitted with `local=True` (which cannot leave this process) still run on
+    threads, under the same admission limit.
+    """
+
+    def __init__(self, kind="thread", max_workers=4, max_queue=16):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown worker pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.capacity = max_workers + max_queue
+
+        if kind == "process":
+            # Spawned rather than forked, the parent already runs threads.
+            self._executor = ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+            self._local_executor = ThreadPoolExecutor(max_workers, thread_name_prefix="local-worker")
+        else:
+            self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="worker")
+            self._local_executor = self._executor
+
+        # Reentrant: an unused Reservation can be collected, and release its slot, while the lock is held.
+        self._lock = threading.RLock()
+        self._admitted = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturated(f"{self._admitted} tasks already admitted")
+            self._admitted += 1
+
+    def reserve(self):
+        """
+        Takes an admission slot now for a task submitted later, so that saturation is reported
+        before the caller commits to anything (e.g. before a streamed response has started).
+
+        Returns:
+            Reservation: To pass to `submit`, or to release if the task is not submitted.
+
+        Raises:
+            PoolSaturated: If all the workers are busy and the queue is full.
+        """
+        self._admit()
+        return Reservation(self)
+
+    def submit(self, fn, *args, local=False, reservation=None, **kwargs):
+        """
+        Submits a task if an admission slot is free.
+
+        Args:
+            fn (callable): The task, picklable when it runs in a process worker.
+            local (bool): Run the task on a thread of this process whatever the pool kind.
+            reservation (Reservation): A slot taken beforehand with `reserve`, used instead of a new one.
+
+        Returns:
+            concurrent.futures.Future: The future of the task.
+
+        Raises:
+            PoolSaturated: If all the workers are busy and the queue is full.
+        """
+        if reservation is None:
+            self._admit()
+        else:
+            reservation.claim()
+
+        executor = self._local_executor if local else self._executor
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release(completed=True))
+        return future
+
+    def _release(self, completed=False):
+        with self._lock:
+            self._admitted -= 1
+            if completed:
+                self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._local_executor is not self._executor:
+            self._local_executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "queued": max(0, self._admitted - self.max_workers),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+
+class JobStore:
+    """
+    Keeps the futures of asynchronous jobs so that clients can poll for their result.
+
+    Finished jobs are forgotten after `ttl_s` seconds, and the oldest finished jobs are dropped
+    when more than `max_jobs` are kept.
+    """
+
+    def __init__(self, max_jobs=1000, ttl_s=3600):
+        self.max_jobs = max_jobs
+        self.ttl_s = ttl_s
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, future, **info):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._jobs[job_id] = {"future": future, "created": time.time(), "finished": None, "info": info}
+
+        def finished(_):
+            with self._lock:
+                if job_id in self._jobs:
+                    self._jobs[job_id]["finished"] = time.time()
+
+        future.add_done_callback(finished)
+        return job_id
+
+    def _expire(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job["finished"] is not None and now - job["finished"] > self.ttl_s:
+                del self._jobs[job_id]
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if job["future"].done():
+                del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Returns the status of a job, with its result or error once finished, or None if unknown."""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        status = {"job_id": job_id, **job["info"]}
+        if not future.done():
+            status["status"] = "running" if future.running() else "queued"
+        elif future.cancelled():
+            status["status"] = "cancelled"
+        elif future.exception() is not None:
+            status["status"] = "failed"
+            status["error"] = str(future.exception())
+        else:
+            status["status"] = "done"
+            status["result"] = future.result()
+        return status